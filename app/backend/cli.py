@@ -0,0 +1,284 @@
+"""
+Command line entry point for the peaking analysis.
+
+    python cli.py run --tracker tracker.xlsx --output /data/peaking_analysis/peaking_analysis --formats xlsx parquet
+    python cli.py incremental --tracker tracker.xlsx --state-dir ~/.cache/peaking_analysis/state
+    python cli.py sweep --grid min_reduction_from_peak=0.05,0.1,0.15 --grid max_inventory_age=4,5,6
+    python cli.py export --table series --city Accra --output accra.csv
+
+Heavy libraries (pandas, numpy, pyarrow) are only imported once a subcommand needs them. run and incremental first
+compare the tracker and the run settings with the manifest of the last run in the results store, and when neither
+changed they report the persisted results without importing them or reading the tracker.
+"""
+
+#Python libraries
+import argparse
+import hashlib
+import json
+import os
+import sys
+from datetime import date
+
+DEFAULT_TRACKER = os.environ.get('PEAKING_TRACKER', '~/Box/C40 (internal)/M&P (internal)/04_Analytics/00_Raw data/01_Emissions/Live tracker/01_GHG Master Tracker.xlsx')
+DEFAULT_OUTPUT_DIR = '/data/peaking_analysis'
+DEFAULT_STORE = os.environ.get('PEAKING_RESULTS_STORE', '/data/peaking_analysis/results_store')
+DEFAULT_DASHBOARD_SNAPSHOT = os.environ.get('PEAKING_DASHBOARD_SNAPSHOT', '/data/peaking_analysis/peaking_emissions_dashboard.arrow')
+DEFAULT_CACHE_DIR = os.environ.get('PEAKING_CACHE_DIR', '~/.cache/peaking_analysis')
+DEFAULT_FORMER_C40_CITIES = ['Basel','Caracas']
+
+#Kept in step with output_writers.FORMATS, which is not imported so that parsing arguments stays cheap
+FORMATS = ['parquet','arrow','csv','xlsx']
+
+RUN_MANIFEST = 'run_manifest.json'
+
+def default_target_path():
+    date_string = str(date.today().day) + '_' + str(date.today().month) + '_' + str(date.today().year)
+    return os.path.join(DEFAULT_OUTPUT_DIR, 'peaking_analysis_{}'.format(date_string))
+
+def file_signature(path):
+    """
+    Returns the path, modification time and size of a file
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    stat = os.stat(path)
+    return {'path':path, 'mtime_ns':stat.st_mtime_ns, 'size':stat.st_size}
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(os.path.expanduser(path), 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def run_settings(args, command, target_path):
+    """
+    Collects the arguments that change the results of a run or where they are written, which must match for a run
+    to be skipped. The default output path has the date in it, so a run with it is skipped at most until the end of
+    the day.
+    """
+    return {'command':command, 'target_path':target_path, 'current_year':args.current_year,
+            'base_year':args.base_year, 'former_c40_cities':sorted(args.former_c40_cities),
+            'trend':getattr(args, 'trend', False), 'formats':sorted(args.formats),
+            'dashboard_snapshot':os.path.abspath(os.path.expanduser(args.dashboard_snapshot))}
+
+def find_unchanged_run(store_dir, tracker_path, settings):
+    """
+    Returns the manifest of the last run if it used the same settings on the same tracker and its outputs still
+    exist. The tracker is only hashed when its modification time or size changed, and a tracker that was touched
+    but not changed has its new signature saved so it is not hashed again.
+    INPUT: Results store directory, tracker path, run settings
+    OUTPUT: Manifest dictionary or None
+    """
+    manifest_path = os.path.join(os.path.expanduser(store_dir), RUN_MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('settings') != settings:
+        return None
+    if not all(os.path.exists(path) for path in manifest['outputs']):
+        return None
+    signature = file_signature(tracker_path)
+    tracker = manifest['tracker']
+    if signature['path'] != tracker['path']:
+        return None
+    if signature['mtime_ns'] != tracker['mtime_ns'] or signature['size'] != tracker['size']:
+        if signature['size'] != tracker['size'] or file_sha256(tracker_path) != tracker['sha256']:
+            return None
+        manifest['tracker'].update(signature)
+        write_manifest(store_dir, manifest)
+    return manifest
+
+def write_manifest(store_dir, manifest):
+    store_dir = os.path.expanduser(store_dir)
+    os.makedirs(store_dir, exist_ok=True)
+    manifest_path = os.path.join(store_dir, RUN_MANIFEST)
+    tmp_path = '{}.{}.tmp'.format(manifest_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+def clear_manifest(store_dir):
+    manifest_path = os.path.join(os.path.expanduser(store_dir), RUN_MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+def publish_results(results, args, target_path):
+    """
+    Writes the outputs of a run, the dashboard snapshot and the results store
+    INPUT: Tuple of 6 DataFrames, parsed arguments, target path without extension
+    OUTPUT: List of paths written
+    """
+    import emissions_analysis as ea
+    import instrumentation
+    import output_writers
+    import results_store
+    written = output_writers.write_outputs(results, target_path, args.formats)
+    with instrumentation.stage('snapshot_write', len(results[4])):
+        ea.write_dashboard_snapshot(results, os.path.expanduser(args.dashboard_snapshot))
+    with instrumentation.stage('store_write', len(results[3]) + len(results[5])):
+        results_store.write_results_store(results, os.path.expanduser(args.store))
+    paths = [path for paths in written.values() for path in paths]
+    return paths + [os.path.abspath(os.path.expanduser(args.dashboard_snapshot)),
+                    os.path.join(os.path.abspath(os.path.expanduser(args.store)), results_store.INDEX_FILE)]
+
+def run_pipeline_command(args, command):
+    """
+    Runs the full or incremental pipeline, unless the tracker and settings are unchanged since the last run
+    """
+    target_path = os.path.abspath(os.path.expanduser(args.output or default_target_path()))
+    settings = run_settings(args, command, target_path)
+    if not args.force:
+        manifest = find_unchanged_run(args.store, args.tracker, settings)
+        if manifest is not None:
+            print('Tracker unchanged since the run of {}, results are in:'.format(manifest['finished']))
+            for path in manifest['outputs']:
+                print('  {}'.format(path))
+            return 0
+
+    #The tracker is fingerprinted before it is read, so a tracker edited during the run is not marked as done
+    tracker = file_signature(args.tracker)
+    tracker['sha256'] = file_sha256(args.tracker)
+    import emissions_analysis as ea
+    import instrumentation
+    #The manifest is removed first so an interrupted run is never mistaken for a complete one
+    clear_manifest(args.store)
+    with instrumentation.recording() as metrics, instrumentation.profiling(args.profile, args.tracemalloc):
+        if command == 'incremental':
+            import incremental_run
+            results, _ = incremental_run.run_incremental_pipeline(
+                args.tracker, args.current_year, args.base_year, args.former_c40_cities,
+                os.path.expanduser(args.state_dir), cache_dir=args.cache_dir)
+        else:
+            results = ea.run_etl_pipeline(args.tracker, args.current_year, args.base_year, args.former_c40_cities,
+                                          cache_dir=args.cache_dir, trend=args.trend)
+        outputs = publish_results(results, args, target_path)
+    print(metrics.format_table())
+    metrics.write_json(args.metrics or target_path + '_metrics.json')
+
+    write_manifest(args.store, {'settings':settings, 'tracker':tracker, 'outputs':outputs,
+                                'finished':date.today().isoformat()})
+    print('Check output file')
+    return 0
+
+def run_command(args):
+    return run_pipeline_command(args, 'run')
+
+def incremental_command(args):
+    return run_pipeline_command(args, 'incremental')
+
+def parse_grid(items):
+    """
+    Parses --grid arguments of the form name=value1,value2
+    INPUT: List of strings
+    OUTPUT: Dictionary of threshold name to list of values
+    """
+    grid = {}
+    for item in items:
+        name, sep, values = item.partition('=')
+        if not sep or not values:
+            raise argparse.ArgumentTypeError('Expected name=value1,value2, got {!r}'.format(item))
+        grid[name] = [float(value) if '.' in value else int(value) for value in values.split(',')]
+    return grid
+
+def sweep_command(args):
+    import emissions_analysis as ea
+    import peaking_sweep
+    grid = parse_grid(args.grid)
+    df1 = ea.read_in_data_from_master_emissions_tracker(args.tracker, args.former_c40_cities, args.cache_dir)
+    df2 = ea.combine_gpc_and_non_gpc_data_sources(df1, args.base_year, args.current_year)
+    grid_df, results = peaking_sweep.run_threshold_sweep(df2, args.current_year, grid, args.processes)
+    target_path = os.path.abspath(os.path.expanduser(args.output or default_target_path() + '_sweep'))
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    peaking_sweep.write_threshold_sweep(grid_df, results, target_path)
+    print(peaking_sweep.summarise_threshold_sweep(grid_df, results).to_string(index=False, float_format='{:g}'.format))
+    return 0
+
+def export_command(args):
+    import results_store
+    import output_writers
+    store = results_store.ResultsStore(args.store)
+    query = store.query(args.table)
+    for column, value in [('City', args.city), ('Data source', args.data_source), ('Peak Status', args.peak_status)]:
+        if value:
+            query = query.where(column, 'in', value)
+    if args.columns:
+        query = query.select(*args.columns)
+    df = query.read()
+
+    fmt = os.path.splitext(args.output)[1].lstrip('.')
+    writers = {'parquet':output_writers.write_parquet, 'arrow':output_writers.write_arrow,
+               'csv':output_writers.write_csv}
+    if fmt == 'xlsx':
+        output_writers.write_excel({args.table:df}, args.output)
+    elif fmt in writers:
+        writers[fmt](df, args.output)
+    else:
+        raise SystemExit('Unknown output format {!r}, expected one of {}'.format(fmt, ', '.join(FORMATS)))
+    print('Wrote {} rows to {}'.format(len(df), args.output))
+    return 0
+
+def add_tracker_arguments(parser):
+    parser.add_argument('--tracker', default=DEFAULT_TRACKER, help='GHG master tracker workbook')
+    parser.add_argument('--current-year', type=int, default=date.today().year)
+    parser.add_argument('--base-year', type=int, default=1990)
+    parser.add_argument('--former-c40-cities', nargs='*', default=DEFAULT_FORMER_C40_CITIES, metavar='CITY')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='Tracker snapshot cache directory')
+
+def add_run_arguments(parser):
+    add_tracker_arguments(parser)
+    parser.add_argument('--output', help='Output path without extension (defaults to a dated path in {})'.format(
+        DEFAULT_OUTPUT_DIR))
+    parser.add_argument('--formats', nargs='+', default=['xlsx'], choices=FORMATS,
+                        help='Output formats, written in parallel')
+    parser.add_argument('--store', default=DEFAULT_STORE, help='Results store directory')
+    parser.add_argument('--dashboard-snapshot', default=DEFAULT_DASHBOARD_SNAPSHOT)
+    parser.add_argument('--force', action='store_true', help='Run even if the tracker and settings are unchanged')
+    parser.add_argument('--metrics', help='Path of the stage metrics JSON file (defaults to the output path with '
+                                          '_metrics.json)')
+    parser.add_argument('--profile', help='Profile the run with cProfile and write the stats to this path')
+    parser.add_argument('--tracemalloc', type=int, default=0, metavar='N',
+                        help='Trace allocations and print the top N allocation sites')
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Runs the peaking analysis')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='Run the ETL pipeline')
+    add_run_arguments(run)
+    run.add_argument('--trend', action='store_true',
+                     help='Add the peak year, confidence and status of a piecewise-linear trend fit')
+    run.set_defaults(func=run_command)
+
+    incremental = subparsers.add_parser('incremental', help='Recompute only cities whose tracker rows changed')
+    add_run_arguments(incremental)
+    incremental.add_argument('--state-dir', default=os.path.join(DEFAULT_CACHE_DIR, 'state'),
+                             help='Directory the previous run is persisted in')
+    incremental.set_defaults(func=incremental_command)
+
+    sweep = subparsers.add_parser('sweep', help='Score a grid of peaking thresholds')
+    add_tracker_arguments(sweep)
+    sweep.add_argument('--grid', action='append', required=True, metavar='NAME=V1,V2',
+                       help='Threshold values to try, repeated for each threshold')
+    sweep.add_argument('--processes', type=int, help='Worker processes (defaults to all cores)')
+    sweep.add_argument('--output', help='Output path without extension')
+    sweep.set_defaults(func=sweep_command)
+
+    export = subparsers.add_parser('export', help='Export rows of the results store')
+    export.add_argument('--store', default=DEFAULT_STORE, help='Results store directory')
+    export.add_argument('--table', choices=['peaks','series'], default='peaks')
+    export.add_argument('--city', nargs='+')
+    export.add_argument('--data-source', nargs='+')
+    export.add_argument('--peak-status', nargs='+')
+    export.add_argument('--columns', nargs='+')
+    export.add_argument('--output', required=True, help='Output path (.csv, .parquet, .arrow or .xlsx)')
+    export.set_defaults(func=export_command)
+    return parser.parse_args(args)
+
+def main(args=None):
+    args = parse_args(args)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,24 +10,50 @@ __application__ = 'Peaking Analysis'
 #Python libararies
 import pandas as pd
 import numpy as np
-import simplejson
-from datetime import date
 import os
+import sys
+
+import instrumentation
+import peak_registry
 
 #Set display options
 pd.options.mode.chained_assignment = None  # default='warn'
 pd.options.display.float_format = '{:.1f}'.format
 
-def read_in_data_from_master_emissions_tracker(path,former_c40_cities):
+TRACKER_SHEET = 'All raw GHG_(excl.C40 GPC data)'
+TRACKER_COLUMNS = ['City name tidy up','Source_Protocol','Inventory\n_year.1', 'Emissions\n_mtCO2e','Use in peaking (Yes or No)']
+
+def read_in_data_from_master_emissions_tracker(path,former_c40_cities,cache_dir=None):
     """
-    Reads in data from 2017 peaking analysis and reshapes for use in programme.
-    INPUT: Excel file (.xlsx)
+    Reads in data from 2017 peaking analysis and reshapes for use in programme. If a cache directory is given the 
+    tracker sheet and the cleaned DataFrame are cached as Arrow snapshots and the workbook is only parsed again 
+    when its contents change.
+    INPUT: Excel file (.xlsx), list of former C40 cities, optional cache directory
+    OUTPUT: Pandas DataFrame
+    """
+    if cache_dir is None:
+        df = pd.read_excel(path, sheet_name=TRACKER_SHEET, header = 1)
+        return clean_master_emissions_tracker(df, former_c40_cities)
+    
+    import tracker_snapshot
+    fingerprint = tracker_snapshot.file_fingerprint(path, cache_dir)
+    
+    def read_and_clean():
+        df = tracker_snapshot.read_excel_snapshot(path, TRACKER_SHEET, cache_dir, columns=TRACKER_COLUMNS, header=1)
+        return clean_master_emissions_tracker(df, former_c40_cities)
+    
+    name = 'tracker-clean-{}'.format(tracker_snapshot.cache_key(os.path.abspath(os.path.expanduser(path))))
+    key = tracker_snapshot.cache_key(fingerprint, sorted(former_c40_cities))
+    return tracker_snapshot.cached_frame(cache_dir, name, key, read_and_clean)
+
+def clean_master_emissions_tracker(df, former_c40_cities):
+    """
+    Tidies the tracker sheet, filters it for valid rows and maps data sources to data quality scores
+    INPUT: DataFrame of the tracker sheet
     OUTPUT: Pandas DataFrame
     """
-    #Read in data
-    df = pd.read_excel(path, sheet_name='All raw GHG_(excl.C40 GPC data)',header = 1) 
     #Tidy column names
-    df = df[['City name tidy up','Source_Protocol','Inventory\n_year.1', 'Emissions\n_mtCO2e','Use in peaking (Yes or No)']] #***
+    df = df[TRACKER_COLUMNS] #***
     df.rename(columns={'City name tidy up':'City', 
                        'Source_Protocol':'Data source',
                        'Inventory\n_year.1':'Year',
@@ -52,13 +78,15 @@ def read_in_data_from_master_emissions_tracker(path,former_c40_cities):
     df = df.sort_values(['City','Year']).reset_index(drop=True)
     return df 
 
-def combine_gpc_and_non_gpc_data_sources(df,base_year,current_year):
+def combine_gpc_and_non_gpc_data_sources(df,base_year,current_year,include_all_sources=False):
     """
     Calculates All GPC Considered and All non-GPC considered rows by combining data sources for each city. Function 
     constructs All GPC Considered rows by backfilling data gaps in C40 GPC data sources with CDP GPC and City GPC data.
     Function constructuct All Non GPC Considered rows by backfilling data gaps in C40 Target Baseline Other data sources
-    with CDP Other and City Other. 
-    INPUT: Master DataFrame with GPC Tracker and Master GHG data
+    with CDP Other and City Other. If include_all_sources is True, All GPC and non GPC considered rows are also 
+    constructed by backfilling gaps in All GPC considered data with non-GPC data.
+    INPUT: Master DataFrame with GPC Tracker and Master GHG data, base year, current year, whether to include All GPC
+    and non GPC considered rows
     OUTPUT: DataFrame with additional All GPC Considered and All non-GPC considered rows
     """
     def reshape_data(df):
@@ -80,90 +108,333 @@ def combine_gpc_and_non_gpc_data_sources(df,base_year,current_year):
     def calculate_gpc_and_non_gpc_combinations(df):
 
         df = df.sort_values(['City','Data source'], ascending = [True, True]).reset_index(drop=True)
-    
-        #Create 3 dataframes for GPC, non-GPC data and all GPC data
-        df1 = df[df['Data quality'] <= 3]
-        df2 = df[df['Data quality'] >= 4]
         
         #Create variable for columns with emissions data 
         cols = df.columns.difference(['City','Data source','Data quality'])
         
-        def combine_rows_for_each_city(df, cols, rows):
-            #Select rows where there is at least 1 city
-            df = df.groupby('City').filter(lambda x: len(x) > 1) 
+        def combine_rows_for_each_city(df, cols):
+            """
+            Builds the combined rows for each city in one pass. Rows are grouped into GPC and non-GPC blocks for 
+            each city and the first non-null value for each year is taken in Data source order, which is what 
+            backfilling each block and keeping its first row did. The All GPC and non GPC considered rows take 
+            the GPC value and fall back to the non-GPC value. Only cities with more than one row in a block 
+            (or in total for All GPC and non GPC considered) get a combined row.
+            INPUT: DataFrame sorted by City and Data source, emissions columns
+            OUTPUT: Tuple of All GPC considered, All non GPC considered and All GPC and non GPC considered rows
+            """
+            df = df.assign(non_gpc = df['Data quality'] >= 4).sort_values(['City','non_gpc'])
+            city = df['City'].to_numpy()
+            non_gpc = df['non_gpc'].to_numpy()
+            n = len(df)
+            if n == 0:
+                empty = df.iloc[:0].drop('non_gpc', axis=1)
+                return empty, empty, empty
             
-            for col in cols:
-                df[col] = df.groupby(['City'], sort=False)[col].apply(lambda x: x.fillna(method='bfill'))
-            df = df.drop_duplicates(subset='City', keep="first")
-
-            if rows == 'all_gpc':
-                df['Data quality'] = 4
-                df['Data source'] = 'All GPC considered'
-            if rows == 'all_non_gpc':
-                df['Data quality'] = 8
-                df['Data source'] = 'All non GPC considered'
-            if rows == 'all_non_gpc_and_all_gpc':
-                df['Data quality'] = 9
-                df['Data source'] = 'All GPC and non GPC considered'
-            return df
-
-        df_all_gpc_considered = combine_rows_for_each_city(df1,cols,'all_gpc')
-        df_all_non_gpc_considered = combine_rows_for_each_city(df2,cols,'all_non_gpc')
+            #Start position of each City and GPC / non-GPC block and the first valid row of each year within it
+            starts = np.flatnonzero(np.r_[True, (city[1:] != city[:-1]) | (non_gpc[1:] != non_gpc[:-1])])
+            sizes = np.diff(np.r_[starts, n])
+            values = df[cols].to_numpy(dtype=np.float64)
+            first_valid = np.minimum.reduceat(np.where(np.isnan(values), n, np.arange(n)[:, None]), starts, axis=0)
+            combined = np.where(first_valid < n, values[np.minimum(first_valid, n - 1), np.arange(len(cols))], np.nan)
+            
+            blocks = df.iloc[starts].drop('non_gpc', axis=1)
+            blocks[cols] = combined
+            block_non_gpc = non_gpc[starts]
+            df_all_gpc = blocks[~block_non_gpc & (sizes > 1)]
+            df_all_non_gpc = blocks[block_non_gpc & (sizes > 1)]
+            
+            #A city's GPC block comes directly before its non-GPC block
+            block_city = city[starts]
+            has_both = np.r_[block_city[1:] == block_city[:-1], False]
+            city_start = np.r_[True, block_city[1:] != block_city[:-1]]
+            city_size = sizes + np.where(has_both, np.r_[sizes[1:], 0], 0)
+            fallback = np.where(has_both[:, None], np.r_[combined[1:], combined[:1]], np.nan)
+            df_all = blocks[city_start & (city_size > 1)]
+            df_all[cols] = np.where(np.isnan(combined), fallback, combined)[city_start & (city_size > 1)]
+            
+            df_all_gpc['Data quality'] = 4
+            df_all_gpc['Data source'] = 'All GPC considered'
+            df_all_non_gpc['Data quality'] = 8
+            df_all_non_gpc['Data source'] = 'All non GPC considered'
+            df_all['Data quality'] = 9
+            df_all['Data source'] = 'All GPC and non GPC considered'
+            return df_all_gpc, df_all_non_gpc, df_all
 
+        df_all_gpc_considered, df_all_non_gpc_considered, df_all_non_gpc_and_gpc_considered = combine_rows_for_each_city(df,cols)
+        
         #Combine dataframes into a master dataset
-        df = df.append([df_all_gpc_considered,
-                        df_all_non_gpc_considered]).reset_index(drop=True)
-                        #df_all_non_gpc_and_gpc_considered]).reset_index(drop=True)
+        combined = [df, df_all_gpc_considered, df_all_non_gpc_considered]
+        if include_all_sources:
+            combined.append(df_all_non_gpc_and_gpc_considered)
+        df = pd.concat(combined).reset_index(drop=True)
         
         df = df.sort_values(['City','Data quality'], ascending = [True,True])
         df.fillna(0, inplace=True) 
         return df
     
-    df = reshape_data(df)
-    df = calculate_gpc_and_non_gpc_combinations(df)    
+    with instrumentation.stage('pivot', len(df)) as s:
+        df = reshape_data(df)
+        s.rows_out = len(df)
+    with instrumentation.stage('backfill', len(df)) as s:
+        df = calculate_gpc_and_non_gpc_combinations(df)    
+        s.rows_out = len(df)
     return df
 
-def calculate_peak_emissions(df, current_year):
+def calculate_peaking_parameters_pandas(df):
     """
-    Analyses city GHG emissions to determine if they have peaked
-    INPUT: DataFrame containing peaking analysis and GPC Tracker GHG emissions
-    OUTPUT: DataFrame with assessment of whether each city has peaked
+    Caclulate parameters used to assess whether city has peaked emissions
+    INPUT: DataFrame
+    OUTPUT: DataFrame with peakign parameters as 4 additional columns
     """
-    def calculate_peaking_parameters(df):
-        """
-        Caclulate parameters used to assess whether city has peaked emissions
-        INPUT: DataFrame
-        OUTPUT: DataFrame with peakign parameters as 4 additional columns
-        """
-        #***cols = df.columns.difference(['City','Data Source','Protocol','Verified by city'])
-        cols = df.columns.difference(['City','Data source','Data quality'])
-        df['Num data points'] = df[cols].gt(0).sum(axis=1)
-        df['Max emissions'] = df[cols].max(axis =1)
-        df['Max emissions year'] = df[cols].idxmax(axis =1)
-        df['Recent emissions'] = df[cols].apply(lambda x: x.iloc[x.to_numpy().nonzero()].iloc[-1], axis=1)
-        df['Recent emissions year'] = df[cols].apply(lambda x: x.iloc[x.to_numpy().nonzero()].index[-1], axis=1)
-        df['Earliest emissions'] = df[cols].apply(lambda x: x.iloc[x.to_numpy().nonzero()].iloc[0], axis=1)
-        df['Earliest emissions year'] = df[cols].apply(lambda x: x.iloc[x.to_numpy().nonzero()].index[0], axis=1)
+    #***cols = df.columns.difference(['City','Data Source','Protocol','Verified by city'])
+    cols = df.columns.difference(['City','Data source','Data quality'])
+    df['Num data points'] = df[cols].gt(0).sum(axis=1)
+    df['Max emissions'] = df[cols].max(axis =1)
+    df['Max emissions year'] = df[cols].idxmax(axis =1)
+    df['Recent emissions'] = df[cols].apply(lambda x: x.iloc[x.to_numpy().nonzero()].iloc[-1], axis=1)
+    df['Recent emissions year'] = df[cols].apply(lambda x: x.iloc[x.to_numpy().nonzero()].index[-1], axis=1)
+    df['Earliest emissions'] = df[cols].apply(lambda x: x.iloc[x.to_numpy().nonzero()].iloc[0], axis=1)
+    df['Earliest emissions year'] = df[cols].apply(lambda x: x.iloc[x.to_numpy().nonzero()].index[0], axis=1)
+    
+    for col in ['Max emissions year','Recent emissions year','Earliest emissions year']:
+        df[col] = pd.to_numeric(df[col],downcast='float',errors="coerce") 
         
-        for col in ['Max emissions year','Recent emissions year','Earliest emissions year']:
-            df[col] = pd.to_numeric(df[col],downcast='float',errors="coerce") 
-            
-        return df
+    return df
+
+def calculate_peaking_parameters_numpy(df):
+    """
+    Calculates the same peaking parameters as calculate_peaking_parameters_pandas in a single pass over the 
+    series x year matrix rather than with row-wise apply calls. Series with no non-zero inventories return NaN for 
+    the earliest and recent emissions parameters.
+    INPUT: DataFrame
+    OUTPUT: DataFrame with peaking parameters as additional columns
+    """
+    cols = df.columns.difference(['City','Data source','Data quality'])
+    values = df[cols].to_numpy(dtype=np.float64)
+    years = np.asarray(cols, dtype=np.float64)
+    n_years = values.shape[1]
+    rows = np.arange(len(values))
     
+    #Non-zero mask matches the .nonzero() selection used by the pandas engine (NaN counts as non-zero)
+    nonzero = values != 0
+    has_data = nonzero.any(axis=1)
+    first = nonzero.argmax(axis=1)
+    last = n_years - 1 - nonzero[:, ::-1].argmax(axis=1)
+    
+    #Max emissions and year skip NaN values in the same way as DataFrame.max and DataFrame.idxmax
+    is_nan = np.isnan(values)
+    has_value = ~is_nan.all(axis=1)
+    peak = np.where(is_nan, -np.inf, values).argmax(axis=1)
+    
+    df['Num data points'] = (values > 0).sum(axis=1)
+    df['Max emissions'] = np.where(has_value, values[rows, peak], np.nan)
+    df['Max emissions year'] = np.where(has_value, years[peak], np.nan)
+    df['Recent emissions'] = np.where(has_data, values[rows, last], np.nan)
+    df['Recent emissions year'] = np.where(has_data, years[last], np.nan)
+    df['Earliest emissions'] = np.where(has_data, values[rows, first], np.nan)
+    df['Earliest emissions year'] = np.where(has_data, years[first], np.nan)
+    
+    for col in ['Max emissions year','Recent emissions year','Earliest emissions year']:
+        df[col] = pd.to_numeric(df[col],downcast='float',errors="coerce") 
+        
+    return df
+
+def calculate_peaking_parameters(df, engine='numpy'):
+    """
+    Calculates peaking parameters with the selected engine. The 'pandas' engine is the original row-wise 
+    implementation and is kept as a reference for the 'numpy' engine.
+    INPUT: DataFrame, engine name ('numpy' or 'pandas')
+    OUTPUT: DataFrame with peaking parameters as additional columns
+    """
+    engines = {'numpy':calculate_peaking_parameters_numpy,
+               'pandas':calculate_peaking_parameters_pandas}
+    if engine not in engines:
+        raise ValueError('Unknown peaking parameter engine: {}'.format(engine))
+    return engines[engine](df)
+
+PEAKING_THRESHOLDS = {
+    'min_data_points':3,            #PC1: At least 3 years of data available
+    'min_years_since_peak':5,       #PC2: Max emissions >5 years before recent inventory
+    'max_inventory_age':5,          #PC3: Recent inventory <5 years old
+    'min_reduction_from_peak':0.1,  #PC4: Max emissions >10% higher than recent inventory
+    }
+
+PEAK_STATUSES = np.array(['Peaked','Not Peaked','Unknown'])
+
+def criteria_labels(thresholds=None):
+    """
+    Returns the column labels of peaking criteria PC1-PC4 for the thresholds in effect
+    INPUT: Dictionary of thresholds overriding PEAKING_THRESHOLDS
+    OUTPUT: Dictionary of column label keyed by criterion name
+    """
+    thresholds = dict(PEAKING_THRESHOLDS, **(thresholds or {}))
+    return {
+        'PC1':'PC1: At least {:g} year of data available'.format(thresholds['min_data_points']),
+        'PC2':'PC2: Max emissions >{:g} years before recent inventory'.format(thresholds['min_years_since_peak']),
+        'PC3':'PC3: Recent inventory <{:g} years old'.format(thresholds['max_inventory_age']),
+        'PC4':'PC4: Max emissions >{:g}% higher than recent inventory'.format(
+            100 * thresholds['min_reduction_from_peak']),
+        }
+
+def evaluate_peaking_criteria(df, current_year, thresholds=None):
+    """
+    Evaluates peaking criteria PC1-PC4 on whole columns of peaking parameters. Threshold values override
+    PEAKING_THRESHOLDS and may be scalars or 1-D arrays holding one value per threshold set, in which case the 
+    criteria using them have shape (threshold sets, rows) so many threshold sets can be scored in one batch.
+    INPUT: DataFrame with peaking parameters, current year, dictionary of thresholds
+    OUTPUT: Dictionary of Boolean arrays keyed by criterion name
+    """
+    thresholds = dict(PEAKING_THRESHOLDS, **(thresholds or {}))
+    
+    def threshold(name):
+        value = np.asarray(thresholds[name])
+        return value[:, None] if value.ndim else value
+    
+    num_data_points = df['Num data points'].to_numpy()
+    max_emissions = df['Max emissions'].to_numpy(dtype=np.float64)
+    max_year = df['Max emissions year'].to_numpy()
+    recent_emissions = df['Recent emissions'].to_numpy(dtype=np.float64)
+    recent_year = df['Recent emissions year'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reduction = (max_emissions - recent_emissions) / max_emissions
+        criteria = {
+            'PC1':num_data_points >= threshold('min_data_points'),
+            'PC2':recent_year - max_year >= threshold('min_years_since_peak'),
+            'PC3':current_year - recent_year <= threshold('max_inventory_age'),
+            'PC4':reduction >= threshold('min_reduction_from_peak'),
+            }
+    return criteria
+
+def classify_peak_status(pc1, pc2, pc3, pc4):
+    """
+    Classifies peaking criteria arrays of any shape. All criteria TRUE is 'Peaked', PC1 and PC3 TRUE with PC4 
+    FALSE is 'Not Peaked' and anything else is 'Unknown'.
+    INPUT: Boolean arrays for PC1-PC4
+    OUTPUT: int8 array of indices into PEAK_STATUSES
+    """
+    peaked = pc1 & pc2 & pc3 & pc4
+    not_peaked = pc1 & pc3 & ~pc4
+    return np.select([peaked, not_peaked], [0, 1], 2).astype(np.int8)
+
+def evaluate_peak_status_for_threshold_sets(df, current_year, threshold_sets):
+    """
+    Scores many threshold sets against the same peaking parameters in one batch
+    INPUT: DataFrame with peaking parameters, current year, list of threshold dictionaries
+    OUTPUT: int8 array of shape (threshold sets, rows) indexing PEAK_STATUSES
+    """
+    names = set().union(*threshold_sets) if threshold_sets else set()
+    thresholds = {name:[t.get(name, PEAKING_THRESHOLDS[name]) for t in threshold_sets] for name in names}
+    criteria = evaluate_peaking_criteria(df, current_year, thresholds)
+    codes = classify_peak_status(criteria['PC1'], criteria['PC2'], criteria['PC3'], criteria['PC4'])
+    return np.broadcast_to(codes, (len(threshold_sets), len(df)))
+
+TREND_THRESHOLDS = {
+    'min_points_each_side':2,       #Inventories needed on each side of a breakpoint
+    'min_confidence':0.9,           #Confidence needed to call a trend Peaked (or 1 - confidence for Not Peaked)
+    }
+
+def erfc(x):
+    """
+    Complementary error function of an array, from the rational approximation 7.1.26 of Abramowitz and Stegun 
+    (absolute error below 1.5e-7). Infinite values give 0 or 2.
+    INPUT: Array
+    OUTPUT: Array
+    """
+    x = np.asarray(x, dtype=np.float64)
+    a = np.abs(x)
+    t = 1 / (1 + 0.3275911 * a)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    tail = poly * np.exp(-a * a)
+    return np.where(x >= 0, tail, 2 - tail)
+
+def fit_peak_trend(df, thresholds=None):
+    """
+    Fits a continuous piecewise-linear trend with one breakpoint to every series at once and reports the peak year 
+    of the trend. Each inventory year with enough inventories on both sides is tried as the breakpoint and the one 
+    with the smallest squared error is kept; the fits for a breakpoint are solved for all series together. The 
+    peak year is the breakpoint when the trend rises before it and falls after it, or the first inventory year when 
+    it falls on both sides. The confidence is the probability that the trend falls after the breakpoint, from the 
+    t-statistic of the post-breakpoint slope under a normal approximation. Inventories of zero are missing.
+    INPUT: DataFrame with year columns (the columns without a string label), dictionary of thresholds overriding 
+    TREND_THRESHOLDS
+    OUTPUT: Dictionary of arrays: 'year' (NaN when the trend has not peaked), 'confidence' (NaN when a series has too 
+    few inventories to fit) and 'status' (int8 indices into PEAK_STATUSES)
+    """
+    thresholds = dict(TREND_THRESHOLDS, **(thresholds or {}))
+    min_side = thresholds['min_points_each_side']
+    years = np.array([col for col in df.columns if not isinstance(col, str)], dtype=np.float64)
+    order = np.argsort(years, kind='stable')
+    years = years[order]
+    values = df[[col for col in df.columns if not isinstance(col, str)]].to_numpy(dtype=np.float64)[:, order]
+    n, n_years = values.shape
+    
+    #Weights mark inventories, emissions are scaled by each series' largest inventory to keep the fits well conditioned
+    w = (values > 0).astype(np.float64)
+    scale = np.where(w > 0, values, 0).max(axis=1, initial=0)
+    y = np.where(w > 0, values, 0) / np.where(scale > 0, scale, 1)[:, None]
+    n_points = w.sum(axis=1)
+    points_before = np.cumsum(w, axis=1)
+    points_after = n_points[:, None] - points_before + w
+    
+    best_sse = np.full(n, np.inf)
+    best_year = np.full(n, np.nan)
+    best_beta = np.full((n, 3), np.nan)
+    best_var = np.full(n, np.nan)
+    identity = np.eye(3)
+    for j in range(n_years):
+        valid = (points_before[:, j] >= min_side) & (points_after[:, j] >= min_side) & (n_points > 3)
+        if not valid.any():
+            continue
+        #Intercept at the breakpoint, slope before and slope after
+        features = np.stack([np.ones(n_years), np.minimum(years - years[j], 0), np.maximum(years - years[j], 0)])
+        gram = (w[valid] @ (features[:, None, :] * features[None, :, :]).reshape(9, n_years).T).reshape(-1, 3, 3)
+        #Breakpoints with all inventories on one side give a singular system, these are replaced and skipped
+        singular = np.abs(np.linalg.det(gram)) < 1e-12
+        inverse = np.linalg.inv(np.where(singular[:, None, None], identity, gram))
+        beta = np.einsum('nij,nj->ni', inverse, (w[valid] * y[valid]) @ features.T)
+        sse = (w[valid] * (y[valid] - beta @ features) ** 2).sum(axis=1)
+        sse[singular] = np.inf
+        
+        rows = np.flatnonzero(valid)
+        better = sse < best_sse[rows]
+        rows = rows[better]
+        best_sse[rows] = sse[better]
+        best_year[rows] = years[j]
+        best_beta[rows] = beta[better]
+        best_var[rows] = inverse[better, 2, 2]
+    
+    fitted = np.isfinite(best_sse)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma2 = np.where(fitted, best_sse, np.nan) / (n_points - 3)
+        t_after = best_beta[:, 2] / np.sqrt(sigma2 * best_var)
+    #P(slope after < 0) = Phi(-t) = erfc(t / sqrt(2)) / 2
+    confidence = np.where(fitted, 0.5 * erfc(np.nan_to_num(t_after, nan=0.0) / np.sqrt(2)), np.nan)
+    
+    first_year = np.where(n_points > 0, years[np.argmax(w > 0, axis=1)], np.nan)
+    falling = best_beta[:, 2] < 0
+    peak_year = np.where(falling & (best_beta[:, 1] > 0), best_year, np.where(falling, first_year, np.nan))
+    
+    status = np.select([fitted & falling & (confidence >= thresholds['min_confidence']),
+                        fitted & (confidence <= 1 - thresholds['min_confidence'])], [0, 1], 2).astype(np.int8)
+    return {'year':peak_year, 'confidence':confidence, 'status':status}
+
+def calculate_peak_emissions(df, current_year, engine='numpy', thresholds=None, trend=False):
+    """
+    Analyses city GHG emissions to determine if they have peaked
+    INPUT: DataFrame containing peaking analysis and GPC Tracker GHG emissions, engine used to calculate the
+    peaking parameters ('numpy' or 'pandas'), dictionary of peaking thresholds overriding PEAKING_THRESHOLDS, 
+    whether to add the peak year, confidence and status of a piecewise-linear trend fit (see fit_peak_trend)
+    OUTPUT: DataFrame with assessment of whether each city has peaked
+    """
     def apply_peaking_criteria(df, current_year):
         """
         Calculates peaking criteria using peaking parameters
         INPUT: DataFrame
         OUTPUT: DataFrame with Boolean assessment for each peaking criteria
         """
-        #Peaking Criteria 1: At least 3 years of data available?
-        df['PC1'] = (df['Num data points'] >= 3)
-        #Peaking Criteria 2: Max emissions >5 years before recent inventory?
-        df['PC2'] = (df['Recent emissions year'] - df['Max emissions year'] >= 5)
-        #Peaking Criteria 3: Recent inventory < 5 years old
-        df['PC3'] = (current_year - df['Recent emissions year'] <= 5)
-        #Peaking Criteria 4: Max emissions >10% higher than recent inventory
-        df['PC4'] = ((df['Max emissions']-df['Recent emissions'])/df['Max emissions']) >= 0.1        
+        criteria = evaluate_peaking_criteria(df, current_year, thresholds)
+        for col in ['PC1','PC2','PC3','PC4']:
+            df[col] = criteria[col]
         #Percentage change since peak
         df['Percentage change since peak (%)'] = ((df['Recent emissions']-df['Max emissions'])/df['Max emissions'])*100
         return df
@@ -174,42 +445,115 @@ def calculate_peak_emissions(df, current_year):
         INPUT: DataFrame
         OUTPUT: DataFrame with peaking assessment as additional columne
         """
-        
-        def evaluate_peaking_criteria(x):
-            
-            if x['PC1'] & x['PC2'] & x['PC3'] & x['PC4']: #If all peaking criteria are TRUE returns 'PEAKED'
-                return 'Peaked'
-            elif x['PC1'] & x['PC3'] & (not x['PC4']): #If first 3 peaking critiera are TRUE and PC4 are FALSE return 'NOT PEAKED'
-                return 'Not Peaked'
-            else: #Otherwise returns 'Unkown'
-                return 'Unknown'
-            
-        #Calculates columns by applying above function across rows 
-        df['Peak Status'] = df.apply(evaluate_peaking_criteria, axis = 1)
+        codes = classify_peak_status(df['PC1'].to_numpy(), df['PC2'].to_numpy(), 
+                                     df['PC3'].to_numpy(), df['PC4'].to_numpy())
+        df['Peak Status'] = np.take(PEAK_STATUSES, codes).astype(object)
         return df 
     
     def rename_columns(df):
         """
         Rename columns for ease of understanding
         """
-        df.rename(columns ={
-            'PC1':'PC1: At least 3 year of data available',
-            'PC2':'PC2: Max emissions >5 years before recent inventory',
-            'PC3':'PC3: Recent inventory <5 years old',
-            'PC4':'PC4: Max emissions <10% higher than recent inventory'},
-            inplace = True)
+        df.rename(columns = criteria_labels(thresholds), inplace = True)
         return df 
   
-    df = calculate_peaking_parameters(df)
-    df = apply_peaking_criteria(df, current_year)
-    df = calculate_peak_emissions_status(df)
-    df = rename_columns(df)
+    with instrumentation.stage('parameters', len(df)) as s:
+        df = calculate_peaking_parameters(df, engine)
+        s.rows_out = len(df)
+    with instrumentation.stage('criteria', len(df)) as s:
+        df = apply_peaking_criteria(df, current_year)
+        df = calculate_peak_emissions_status(df)
+        df = rename_columns(df)
+        s.rows_out = len(df)
+    if trend:
+        with instrumentation.stage('trend', len(df)) as s:
+            fit = fit_peak_trend(df)
+            df['Trend peak year'] = fit['year']
+            df['Trend peak confidence'] = fit['confidence']
+            df['Trend Peak Status'] = np.take(PEAK_STATUSES, fit['status']).astype(object)
+            s.rows_out = len(df)
     return df
     
-def select_cities_to_use_in_dashboard(df):
+def find_city_starts(cities):
+    """
+    Returns the start position of each run of equal values in an array of cities sorted by city
+    """
+    cities = np.asarray(cities)
+    if len(cities) == 0:
+        return np.array([], dtype=np.intp)
+    return np.flatnonzero(np.r_[True, cities[1:] != cities[:-1]])
+
+def select_data_source_for_each_city(city_starts, status_codes, num_data_points):
+    """
+    Applies the select_cities decision rules to rows sorted by City and Data quality without looping over cities.
+    A city is 'Peaked' if it has at least as many Peaked as Not Peaked data sources, 'Not Peaked' if it has more
+    Not Peaked data sources and 'Unknown' otherwise. The first data source with the city status is selected, or 
+    for Unknown cities the data source with the most data points. Status codes may hold one row per threshold set.
+    INPUT: Start position of each city, status codes indexing PEAK_STATUSES (rows or threshold sets x rows), 
+    Num data points for each row
+    OUTPUT: Tuple of city status codes and selected row positions with shape (cities) or (threshold sets, cities)
+    """
+    codes = np.atleast_2d(status_codes)
+    n = codes.shape[1]
+    city_starts = np.asarray(city_starts, dtype=np.intp)
+    if n == 0:
+        city_status = np.empty((codes.shape[0], 0), dtype=np.int8)
+        selected = np.empty((codes.shape[0], 0), dtype=np.intp)
+    else:
+        n_peaked = np.add.reduceat(codes == 0, city_starts, axis=1)
+        n_not_peaked = np.add.reduceat(codes == 1, city_starts, axis=1)
+        city_status = np.select([(n_peaked > 0) & (n_peaked >= n_not_peaked), n_not_peaked > n_peaked], [0, 1], 2)
+        city_status = city_status.astype(np.int8)
+        
+        #Rank candidate rows so the max within each city is the selected row. Peaked and Not Peaked cities take 
+        #their first candidate. Unknown cities take the most data points and the first candidate among ties, which 
+        #is the best data quality, as the descending sort_values in select_cities keeps tied rows in order.
+        city_of_row = np.repeat(np.arange(len(city_starts)), np.diff(np.append(city_starts, n)))
+        choice = city_status[:, city_of_row]
+        position = np.arange(n)
+        points = np.asarray(num_data_points, dtype=np.int64)
+        rank = np.where(choice == 2, points, 0) * (n + 1) + (n - position)
+        rank = np.where(codes == choice, rank, -1)
+        best = np.maximum.reduceat(rank, city_starts, axis=1) % (n + 1)
+        selected = n - best
+    
+    if np.ndim(status_codes) == 1:
+        return city_status[0], selected[0]
+    return city_status, selected
+
+def find_new_peaked_cities(df, cities):
+    """
+    Finds cities shown as peaked on the dashboard that are not in the dictionary of previously peaked cities
+    INPUT: DataFrame returned by select_cities_to_use_in_dashboard, dictionary of cities that have previously peaked
+    OUTPUT: Dictionary of newly peaked cities and their data sources
+    """
+    df = df[(df['Use for dashboard?'] == 'yes')&(df['Peak Status']=='Peaked')]
+    df = df[~df['City'].isin(list(cities))].drop_duplicates('City')
+    return dict(zip(df['City'], df['Data source']))
+
+def report_new_peaked_cities(new_cities, registry):
     """
-    Selects data sources to use in dashboard for each city
-    INPUT: DataFrame 
+    Prints newly peaked cities and adds them to the registry in one batch
+    INPUT: Dictionary of newly peaked cities and their data sources, registry (or None)
+    OUTPUT: None
+    """
+    if new_cities:
+        print('New cities have peaked!')
+        for city in new_cities:
+            print(city)
+        if registry is not None:
+            registry.upsert(new_cities)
+    else:
+        print('No new cities have peaked')
+
+def select_cities_to_use_in_dashboard(df, cities=None, registry=None, report=True):
+    """
+    Selects data sources to use in dashboard for each city. Cities that have previously peaked are read from the
+    peaked city registry unless given as a dictionary, and newly peaked cities are added to the registry.
+    INPUT: DataFrame, optional dictionary of cities that have previously peaked and their data sources, optional
+    PeakedCityRegistry (defaults to peak_registry.get_registry()), whether to print and register newly peaked 
+    cities (callers selecting a part of the cities at a time collect them with find_new_peaked_cities and report 
+    them once with report_new_peaked_cities)
     OUTPUT: DataFrame with sorted cities containing NO duplicates for use in peaking analysis dashboard 
     """    
     def select_cities(df):
@@ -220,42 +564,17 @@ def select_cities_to_use_in_dashboard(df):
         INPUT: DataFrame
         OUTPUT: DataFrame with additional column identifying which record to use for each city 
         """
-        #Create copy of dataframe and order by city and num data points 
-
+        #Order by city and data quality so the first row of each status is the best quality data source
         df = df.sort_values(['City','Data quality']).reset_index(drop=True)
-        df1 = df.copy()
-            
-        for city, group in df1.groupby('City'):
-            
-            try: n_peaked = group['Peak Status'].value_counts()['Peaked']
-            except: n_peaked = 0
-                
-            try: n_not_peaked = group['Peak Status'].value_counts()['Not Peaked']
-            except: n_not_peaked = 0
-                
-            try: unknown = group['Peak Status'].value_counts()['Unknown']
-            except: unknown = 0
-                
-            if n_peaked > 0 and n_peaked >= n_not_peaked:
-                selected_index = group[group['Peak Status']=='Peaked'].index[0]
-
-            elif n_not_peaked > 0 and n_not_peaked > n_peaked:
-                selected_index = group[group['Peak Status']=='Not Peaked'].index[0]
-
-            else:
-                selected_index = group[group['Peak Status']=='Unknown'].sort_values('Num data points',ascending=False).index[0]
-                
-            df.loc[selected_index,'Use for dashboard?'] = 'yes'
-
-        df['Use for dashboard?'].fillna('no', inplace = True)
+        city_starts = find_city_starts(df['City'].to_numpy())
+        status_codes = pd.Categorical(df['Peak Status'], categories=PEAK_STATUSES).codes
+        _, selected = select_data_source_for_each_city(city_starts, status_codes, df['Num data points'].to_numpy())
+        
+        use = np.full(len(df), 'no', dtype=object)
+        use[selected] = 'yes'
+        df['Use for dashboard?'] = use
         return df
     
-    def read_in_cities_that_have_peaked():
-        df_temp = pd.read_sql_table(table_name='city_peak_emissions',schema='city_data',con=database.connect_to_database())
-        cities = dict(zip(list(df_temp['c40_city_name']),list(df_temp['data_source'])))
-        n = len(cities.keys())
-        return cities, n
-    
     def check_emissions_status_of_cities_that_have_peaked(cities, df):
         """
         Checks whether cities that have previously peaked are shown as having peaked. If not, and if PC4 is still
@@ -263,113 +582,154 @@ def select_cities_to_use_in_dashboard(df):
         INPUT: Dictionary of cities and data sources
         OUTPUT: DataFrame
         """
-        for city, data_source in cities.items():
-            try:
-                current_status = df[(df['City']==city) & (df['Use for dashboard?']=='yes')]['Peak Status'].values[0]
-                current_index = df[(df['City']==city) & (df['Use for dashboard?']=='yes')]['Peak Status'].index[0]
-                if current_status != 'Peaked':
-                    peak_index = df[(df['City']==city) & (df['Data source'] == data_source)].index[0]
-                    if df.loc[peak_index, 'Percentage change since peak (%)']<=5.0:
-                        df.loc[peak_index, 'Peak Status'] = 'Peaked'
-                        if peak_index != current_index:
-                            df.loc[peak_index, 'Use for dashboard?'] = 'yes'
-                            df.loc[current_index, 'Use for dashboard?'] = 'no'
-                    else:
-                        df.loc[peak_index, 'Peak Status'] = 'Peak Reversed'
-                        
-            except:
-                continue
+        if not cities or df.empty:
+            return df
+        peaked = pd.DataFrame({'City':list(cities.keys()), 'Data source':list(cities.values())})
+        
+        #Row currently used for each city and row of each (City, Data source)
+        current = df[df['Use for dashboard?']=='yes'].drop_duplicates('City')
+        current = pd.DataFrame({'City':current['City'].to_numpy(), 'current_index':current.index, 
+                                'current_status':current['Peak Status'].to_numpy()})
+        sources = df[['City','Data source']].drop_duplicates()
+        sources = pd.DataFrame({'City':sources['City'].to_numpy(), 'Data source':sources['Data source'].to_numpy(),
+                                'peak_index':sources.index})
+        
+        peaked = peaked.merge(current, on='City').merge(sources, on=['City','Data source'])
+        peaked = peaked[peaked['current_status'] != 'Peaked']
+        
+        peak_index = peaked['peak_index'].to_numpy()
+        current_index = peaked['current_index'].to_numpy()
+        still_peaked = (df.loc[peak_index, 'Percentage change since peak (%)'] <= 5.0).to_numpy()
+        swap = still_peaked & (peak_index != current_index)
+        
+        df.loc[peak_index[still_peaked], 'Peak Status'] = 'Peaked'
+        df.loc[peak_index[~still_peaked], 'Peak Status'] = 'Peak Reversed'
+        df.loc[peak_index[swap], 'Use for dashboard?'] = 'yes'
+        df.loc[current_index[swap], 'Use for dashboard?'] = 'no'
         return df
     
-    def count_cities_that_have_peaked(df, cities,n): # removed cities that have already peaked
+    def count_cities_that_have_peaked(df, cities, registry): # removed cities that have already peaked
         """
-        Updates text file with dictionary of cities and data sources that have peaked
-        INPUT: DataFrame
-        OUTPUT: Dictionary written to text file
+        Reports cities that have peaked and are not yet in the registry and adds them to the registry
+        INPUT: DataFrame, dictionary of cities that have previously peaked, registry (or None)
+        OUTPUT: Dictionary of newly peaked cities and their data sources
         """
-        df = df[(df['Use for dashboard?'] == 'yes')&(df['Peak Status']=='Peaked')]
-        if len(df) > n:
-            print('New cities have peaked!')
-            for city in list(df['City'].unique()):
-                if city not in cities.keys():
-                    print(city)
-        else:
-            print('No new cities have peaked')
-
-    df = select_cities(df)
-    cities, n = read_in_cities_that_have_peaked()
-    df = check_emissions_status_of_cities_that_have_peaked(cities, df)
-    count_cities_that_have_peaked(df, cities,n)
+        new_cities = find_new_peaked_cities(df, cities)
+        report_new_peaked_cities(new_cities, registry)
+        return new_cities
+
+    with instrumentation.stage('selection', len(df)) as s:
+        df = select_cities(df)
+        s.rows_out = len(df)
+    with instrumentation.stage('registry', len(df)) as s:
+        if cities is None:
+            registry = registry if registry is not None else peak_registry.get_registry()
+            cities = registry.read()
+        df = check_emissions_status_of_cities_that_have_peaked(cities, df)
+        if report:
+            count_cities_that_have_peaked(df, cities, registry)
+        s.rows_out = len(df)
     return df
 
 def reshape_data_for_dashboard(df):
     """
-    Reshapes data for use in dashboard
+    Reshapes data for use in dashboard. Rows are ordered by City and Year, and by Data quality within a year. City, 
+    Data source, Peak Status and Use for dashboard? are categorical and Year is int16 to keep the long DataFrame small.
     INPUT: DataFrame (Years as rows)
     OUTPUT: DataFrame (Years as column)
     """
-    cols = df.columns.difference(['Verified by city','Num data points', 'Max emissions', 'Recent emissions',
-                                  'Earliest emissions', 'Earliest emissions year',
-                                  'Recent emissions year', 'PC1: At least 3 year of data available', 
-                                  'PC2: Max emissions >5 years before recent inventory', 
-                                  'PC3: Recent inventory <5 years old', 
-                                  'PC4: Max emissions <10% higher than recent inventory',
-                                  'Percentage change since peak (%)',
-                                  'Kaya identity used?','Num modelled data points'])
-    df = df[cols] 
-    df = pd.melt(df, id_vars=["City", "Data source", "Data quality","Peak Status", "Max emissions year","Use for dashboard?"], var_name="Year", value_name="Emissions").sort_values(['City', 'Year']).reset_index(drop=True)
-    df['Peak year'] = df.apply(lambda x : 1 if x['Max emissions year'] == x['Year'] and x['Peak Status'] == 'Peaked' else 0, axis=1)
-    df.drop('Max emissions year', axis = 1, inplace = True)
-    
-    df1 = df.copy()
-    df2 = df.copy()
-    
-    df1 = df1[df1['Use for dashboard?'] == 'yes']
-    df1 = df1.drop('Use for dashboard?',axis=1)
+    #Year columns are the only columns without a string label
+    years = [col for col in df.columns if not isinstance(col, str)]
+    with instrumentation.stage('melt', len(df)) as s:
+        values = df[years].to_numpy(dtype=np.float64)
+        year_values = np.asarray(years, dtype=np.float64)
+        n_rows, n_years = values.shape
+        
+        #Row and year of each long row, ordered by City, Year and the row order of df
+        row = np.repeat(np.arange(n_rows), n_years)
+        year_index = np.tile(np.arange(n_years), n_rows)
+        year_rank = np.argsort(np.argsort(year_values, kind='stable'), kind='stable')
+        order = np.lexsort((row, year_rank[year_index], pd.Categorical(df['City']).codes[row]))
+        row, year_index = row[order], year_index[order]
+        
+        def repeat_as_categorical(col):
+            categorical = pd.Categorical(df[col])
+            return pd.Categorical.from_codes(categorical.codes[row], categorical.categories)
+        
+        peaked = (df['Peak Status'] == 'Peaked').to_numpy()
+        max_year = df['Max emissions year'].to_numpy(dtype=np.float64)
+        long = pd.DataFrame({
+            'City':repeat_as_categorical('City'),
+            'Data source':repeat_as_categorical('Data source'),
+            'Data quality':df['Data quality'].to_numpy()[row].astype(np.int8),
+            'Peak Status':repeat_as_categorical('Peak Status'),
+            'Use for dashboard?':repeat_as_categorical('Use for dashboard?'),
+            'Year':year_values[year_index].astype(np.int16),
+            'Emissions':values[row, year_index],
+            'Peak year':(peaked[row] & (max_year[row] == year_values[year_index])).astype(np.int8),
+            })
+        s.rows_out = len(long)
     
-    return df1, df2
+    df1 = long.loc[(long['Use for dashboard?'] == 'yes').to_numpy(), long.columns != 'Use for dashboard?']
+    return df1, long
 
 
-def run_etl_pipeline(path, current_year, base_year, former_c40_cities):
+def run_etl_pipeline(path, current_year, base_year, former_c40_cities, engine='numpy', thresholds=None, 
+                     cache_dir=None, include_all_sources=False, registry=None, trend=False):
     """
     Generates DataFrames used in the programme by calling above functions
-    INPUT: File paths to 2017 Peaking Analysis and GPC Tracker
+    INPUT: File paths to 2017 Peaking Analysis and GPC Tracker, peaking parameter engine ('numpy' or 'pandas'),
+    dictionary of peaking thresholds overriding PEAKING_THRESHOLDS, optional cache directory for tracker snapshots,
+    whether to include All GPC and non GPC considered rows, optional PeakedCityRegistry, whether to add the trend
+    fit columns
     OUTPUT: Tuple of 6 DataFrames
     """
-    print('F1')
-    df1 = read_in_data_from_master_emissions_tracker(path, former_c40_cities)
-    print('F2')
-    df2 = combine_gpc_and_non_gpc_data_sources(df1,base_year,current_year)
-    print('F3')
-    df3 = calculate_peak_emissions(df2,current_year)
-    print('F4')
-    df4 = select_cities_to_use_in_dashboard(df3)
-    print('F5')
-    df5, df6 = reshape_data_for_dashboard(df4)
+    with instrumentation.stage('read') as s:
+        df1 = read_in_data_from_master_emissions_tracker(path, former_c40_cities, cache_dir)
+        s.rows_out = len(df1)
+    with instrumentation.stage('combine', len(df1)) as s:
+        df2 = combine_gpc_and_non_gpc_data_sources(df1,base_year,current_year,include_all_sources)
+        s.rows_out = len(df2)
+    with instrumentation.stage('peak', len(df2)) as s:
+        df3 = calculate_peak_emissions(df2,current_year,engine,thresholds,trend)
+        s.rows_out = len(df3)
+    with instrumentation.stage('select', len(df3)) as s:
+        df4 = select_cities_to_use_in_dashboard(df3, registry=registry)
+        s.rows_out = len(df4)
+    with instrumentation.stage('reshape', len(df4)) as s:
+        df5, df6 = reshape_data_for_dashboard(df4)
+        s.rows_out = len(df6)
     return (df1, df2, df3, df4, df5, df6) 
 
 def write_to_excel(results,target_path):
     """
-    Writes dataframes to Excel
+    Writes dataframes to Excel with XlsxWriter in constant memory mode
     INPUT: Tuple of 6 DataFrames
     OUTPUT: None
     """
-    #Create a Pandas Excel writer using XlsxWriter as the engine
-    writer = pd.ExcelWriter(target_path, engine='xlsxwriter')
-    results[3].to_excel(writer, sheet_name='MASTER_Emissions', index = False)
-    results[5].to_excel(writer, sheet_name='PEAKING_Emissions', index = False)
-    writer.save()
-
-def main():
-    current_year = date.today().year
-    base_year = 1990
-    path = '~/Box/C40 (internal)/M&P (internal)/04_Analytics/00_Raw data/01_Emissions/Live tracker/01_GHG Master Tracker.xlsx'
-    date_string = str(date.today().day) + '_' + str(date.today().month) + '_' + str(date.today().year)
-    target_path = os.path.join('/data/peaking_analysis/peaking_analysis_{}.xlsx'.format(date_string))
-    former_c40_cities = ['Basel','Caracas']
-    results = run_etl_pipeline(path, current_year, base_year, former_c40_cities)
-    write_to_excel(results, target_path)
-    print('Check output file')
+    import output_writers
+    frames = {name:results[index] for name, index in output_writers.OUTPUTS.items()}
+    with instrumentation.stage('excel_write', len(results[3]) + len(results[5])) as s:
+        output_writers.write_excel(frames, target_path)
+        s.rows_out = s.rows_in
+
+def write_dashboard_snapshot(results,target_path):
+    """
+    Writes the dashboard DataFrame as an Arrow snapshot for the Dash app, which reloads it when it changes. The
+    snapshot is replaced atomically so the app never reads a partly written file.
+    INPUT: Tuple of 6 DataFrames, target path (.arrow)
+    OUTPUT: None
+    """
+    import tracker_snapshot
+    os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+    tracker_snapshot.write_frame_snapshot(results[4].reset_index(drop=True), target_path)
+
+def main(args=None):
+    """
+    Runs the pipeline with the run subcommand of cli.py, which accepts the same options
+    """
+    import cli
+    return cli.main(['run'] + list(sys.argv[1:] if args is None else args))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
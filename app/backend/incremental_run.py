@@ -0,0 +1,158 @@
+"""
+Runs the peaking analysis incrementally. Only cities whose tracker rows changed since the last persisted run are
+recomputed and their results are spliced into the previous outputs.
+"""
+
+#Python libraries
+import json
+import os
+import time
+
+import pandas as pd
+
+import emissions_analysis as ea
+import tracker_snapshot
+
+#Snapshot names of the six DataFrames returned by run_etl_pipeline
+RESULT_NAMES = ['tracker','combined','peaking','selected','dashboard','dashboard_all']
+
+def hash_city_data_sources(df):
+    """
+    Hashes the tracker rows of each City and Data source so changed inventories can be found between runs
+    INPUT: DataFrame returned by read_in_data_from_master_emissions_tracker
+    OUTPUT: Series of uint64 hashes indexed by City and Data source
+    """
+    row_hashes = pd.util.hash_pandas_object(df[['City','Data source','Data quality','Year','Emissions']], index=False)
+    return row_hashes.groupby([df['City'], df['Data source']]).sum()
+
+def find_changed_cities(previous_hashes, hashes):
+    """
+    Lists cities with a City and Data source whose rows were added, removed or changed
+    INPUT: Series returned by hash_city_data_sources for the previous and the new tracker
+    OUTPUT: Sorted list of cities
+    """
+    aligned = pd.concat([previous_hashes.rename('previous'), hashes.rename('new')], axis=1)
+    changed = aligned[aligned['previous'] != aligned['new']]
+    return sorted(changed.index.get_level_values(0).unique())
+
+def load_previous_run(state_dir):
+    """
+    Loads the manifest, tracker hashes and results persisted by the last run
+    INPUT: State directory
+    OUTPUT: Tuple of manifest dictionary, hashes Series and list of 6 DataFrames, or None if there is no run
+    """
+    manifest_path = os.path.join(state_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    hashes = tracker_snapshot.read_frame_snapshot(os.path.join(state_dir, 'hashes.arrow'))
+    hashes = hashes.set_index(['City','Data source'])['Hash'].astype('uint64')
+    results = [tracker_snapshot.read_frame_snapshot(os.path.join(state_dir, name + '.arrow')) for name in RESULT_NAMES]
+    return manifest, hashes, results
+
+def save_run(state_dir, manifest, hashes, results):
+    """
+    Persists a run so the next incremental run can reuse it. The manifest is written last so an interrupted save
+    is never read as complete.
+    INPUT: State directory, manifest dictionary, hashes Series, tuple of 6 DataFrames
+    OUTPUT: None
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    manifest_path = os.path.join(state_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    tracker_snapshot.write_frame_snapshot(hashes.rename('Hash').astype('int64').reset_index(),
+                                          os.path.join(state_dir, 'hashes.arrow'))
+    for name, df in zip(RESULT_NAMES, results):
+        tracker_snapshot.write_frame_snapshot(df.reset_index(drop=True), os.path.join(state_dir, name + '.arrow'))
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+def splice_results(previous, df1, recomputed, cities):
+    """
+    Replaces the rows of recomputed cities in the previous results and restores the row order of a full run
+    INPUT: List of 6 previous DataFrames, new tracker DataFrame, tuple of peaking, selected and long dashboard 
+    DataFrames for the recomputed cities, list of recomputed cities
+    OUTPUT: Tuple of 6 DataFrames in the layout returned by run_etl_pipeline
+    """
+    def splice(old, new, sort_by):
+        df = pd.concat([old[~old['City'].isin(cities)], new[old.columns]], ignore_index=True)
+        #Categories differ between the two parts, so categorical columns are rebuilt from the spliced values
+        for col in old.columns:
+            if isinstance(old[col].dtype, pd.CategoricalDtype) and not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype('category')
+        return df.sort_values(sort_by).reset_index(drop=True)
+
+    #As in run_etl_pipeline the combined DataFrame is the same object as the peaking DataFrame
+    df3 = splice(previous[2], recomputed[0], ['City','Data quality'])
+    df4 = splice(previous[3], recomputed[1], ['City','Data quality'])
+    df6 = splice(previous[5], recomputed[2], ['City','Year','Data quality'])
+    df5 = df6[df6['Use for dashboard?'] == 'yes'].drop('Use for dashboard?', axis=1)
+    return (df1, df3, df3, df4, df5, df6)
+
+def run_incremental_pipeline(path, current_year, base_year, former_c40_cities, state_dir, engine='numpy',
+                             thresholds=None, cache_dir=None, registry=None):
+    """
+    Runs the ETL pipeline, recomputing only cities whose tracker rows changed since the last run persisted in the
+    state directory. A full run is done when there is no previous run, when the run settings changed, when the
+    set of year columns changed or when the previous results have other peaking criteria labels.
+    INPUT: Tracker path, current year, base year, former C40 cities, state directory, peaking parameter engine,
+    peaking thresholds, optional tracker cache directory, optional PeakedCityRegistry
+    OUTPUT: Tuple of 6 DataFrames as returned by run_etl_pipeline and a report dictionary with the number of
+    cities recomputed and the time taken by each stage in seconds
+    """
+    stage_seconds = {}
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        stage_seconds[stage] = time.perf_counter() - start
+        return result
+
+    settings = {'current_year':current_year, 'base_year':base_year, 'engine':engine,
+                'former_c40_cities':sorted(former_c40_cities), 'thresholds':thresholds or {}}
+    df1 = timed('read', ea.read_in_data_from_master_emissions_tracker, path, former_c40_cities, cache_dir)
+    hashes = hash_city_data_sources(df1)
+    all_cities = sorted(df1['City'].unique())
+
+    previous = load_previous_run(state_dir)
+    full_run = True
+    if previous is not None and previous[0]['settings'] == settings:
+        previous_results = previous[2]
+        #Year columns come from the whole tracker, so a change in the set of years needs a full run
+        id_columns = ['City','Data source','Data quality']
+        columns = [c for c in previous_results[1].columns if c in id_columns or not isinstance(c, str)]
+        full_years = set(df1['Year'].unique()) | set(range(base_year, current_year + 1))
+        full_run = set(columns[len(id_columns):]) != full_years
+        #Results saved with other peaking criteria labels cannot be spliced with new ones
+        full_run = full_run or not set(ea.criteria_labels(thresholds).values()) <= set(previous_results[2].columns)
+
+    if full_run:
+        cities = all_cities
+        df2 = timed('combine', ea.combine_gpc_and_non_gpc_data_sources, df1, base_year, current_year)
+        df3 = timed('peak', ea.calculate_peak_emissions, df2, current_year, engine, thresholds)
+        df4 = timed('select', ea.select_cities_to_use_in_dashboard, df3, None, registry)
+        df5, df6 = timed('reshape', ea.reshape_data_for_dashboard, df4)
+        results = (df1, df2, df3, df4, df5, df6)
+    else:
+        cities = find_changed_cities(previous[1], hashes)
+        if cities:
+            subset = df1[df1['City'].isin(cities)]
+            df2 = timed('combine', ea.combine_gpc_and_non_gpc_data_sources, subset, base_year, current_year)
+            df2 = df2.reindex(columns=columns, fill_value=0)
+            df3 = timed('peak', ea.calculate_peak_emissions, df2, current_year, engine, thresholds)
+            df4 = timed('select', ea.select_cities_to_use_in_dashboard, df3, None, registry)
+            df5, df6 = timed('reshape', ea.reshape_data_for_dashboard, df4)
+            results = timed('splice', splice_results, previous_results, df1, (df3, df4, df6), cities)
+        else:
+            unchanged = (previous_results[2].iloc[:0], previous_results[3].iloc[:0], previous_results[5].iloc[:0])
+            results = splice_results(previous_results, df1, unchanged, cities)
+
+    manifest = {'settings':settings, 'tracker':os.path.abspath(os.path.expanduser(path))}
+    timed('save', save_run, state_dir, manifest, hashes, results)
+    report = {'cities_recomputed':len(cities), 'cities_total':len(all_cities), 'full_run':full_run,
+              'stage_seconds':stage_seconds}
+    print('Recomputed {} of {} cities'.format(report['cities_recomputed'], report['cities_total']))
+    for stage, seconds in stage_seconds.items():
+        print('  {:<8} {:.3f}s'.format(stage, seconds))
+    return results, report
@@ -0,0 +1,196 @@
+"""
+Records wall time, CPU time, memory and row counts for the stages of a pipeline run. Stages are opened with
+`stage()` and nest through a context variable, so sub-steps are recorded under the stage that called them. Nothing
+is recorded unless a run is being recorded with `recording()`.
+
+    with instrumentation.recording() as metrics:
+        results = ea.run_etl_pipeline(...)
+    metrics.write_json('metrics.json')
+"""
+
+#Python libraries
+import contextlib
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: #Windows
+    resource = None
+
+_metrics = contextvars.ContextVar('peaking_metrics', default=None)
+_stage = contextvars.ContextVar('peaking_stage', default=None)
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of the process so far in MB, or None where it is not available
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+def current_rss_mb():
+    """
+    Returns the current resident set size of the process in MB, or None where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+
+class StageRecord(object):
+    """
+    Measurements of one stage. rows_in and rows_out are set by the code running the stage. CPU time is that of the
+    whole process, so it includes other threads running at the same time. The RSS is sampled when the stage starts
+    and ends, and peak_rss_increase_mb is how far the stage raised the process peak RSS, which is 0 when the stage
+    stayed below an earlier peak.
+    """
+    __slots__ = ['name', 'depth', 'wall_seconds', 'process_cpu_seconds', 'rss_start_mb', 'rss_end_mb',
+                 'peak_rss_increase_mb', 'traced_peak_mb', 'rows_in', 'rows_out', '_traced_peak']
+
+    def __init__(self, name, depth, rows_in=None):
+        self.name = name
+        self.depth = depth
+        self.wall_seconds = None
+        self.process_cpu_seconds = None
+        self.rss_start_mb = None
+        self.rss_end_mb = None
+        self.peak_rss_increase_mb = None
+        self.traced_peak_mb = None
+        self.rows_in = rows_in
+        self.rows_out = None
+        self._traced_peak = 0
+
+    def to_dict(self):
+        return {name:getattr(self, name) for name in self.__slots__ if not name.startswith('_')}
+
+class RunMetrics(object):
+    """
+    Stage records of one run in the order the stages started
+    """
+    def __init__(self):
+        self.records = []
+
+    def to_dict(self):
+        return {'stages':[record.to_dict() for record in self.records], 'peak_rss_mb':peak_rss_mb()}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=1)
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            f.write(self.to_json())
+
+    def format_table(self):
+        """
+        Formats the records as a text table with sub-steps indented under their stage
+        """
+        def fmt(value, spec):
+            return format(value, spec) if value is not None else '-'
+        row = '{:<28} {:>9} {:>9} {:>11} {:>11} {:>10} {:>10}'
+        lines = [row.format('stage', 'wall s', 'cpu s*', 'rss end MB', '+peak MB', 'rows in', 'rows out')]
+        for record in self.records:
+            name = '  ' * record.depth + record.name.rsplit('.', 1)[-1]
+            lines.append(row.format(
+                name, fmt(record.wall_seconds, '.3f'), fmt(record.process_cpu_seconds, '.3f'),
+                fmt(record.rss_end_mb, '.0f'), fmt(record.peak_rss_increase_mb, '.0f'), fmt(record.rows_in, 'd'),
+                fmt(record.rows_out, 'd')))
+        lines.append('* CPU time of the whole process, including threads of other stages running at the same time')
+        lines.append('+peak MB: rise in the process peak RSS during the stage, 0 if it stayed below an earlier peak')
+        return '\n'.join(lines)
+
+@contextlib.contextmanager
+def recording():
+    """
+    Records the stages run inside the block
+    OUTPUT: RunMetrics, filled in as stages finish
+    """
+    metrics = RunMetrics()
+    token = _metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _metrics.reset(token)
+
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+    """
+    Records a stage of the current run. Stages opened inside another stage are named '<parent>.<name>'.
+    INPUT: Stage name, optional number of input rows
+    OUTPUT: StageRecord, whose rows_out can be set inside the block
+    """
+    metrics = _metrics.get()
+    parent = _stage.get()
+    record = StageRecord(name if parent is None else parent.name + '.' + name,
+                         0 if parent is None else parent.depth + 1, rows_in)
+    if metrics is None:
+        yield record
+        return
+
+    metrics.records.append(record)
+    token = _stage.set(record)
+    #Per stage traced peaks need tracemalloc.reset_peak (Python 3.9+)
+    tracing = tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak')
+    if tracing:
+        #The traced peak is reset for each stage, so the peak seen so far is handed to the parent first
+        traced_before, traced_peak = tracemalloc.get_traced_memory()
+        if parent is not None:
+            parent._traced_peak = max(parent._traced_peak, traced_peak)
+        tracemalloc.reset_peak()
+    record.rss_start_mb = current_rss_mb()
+    peak_before = peak_rss_mb()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record.wall_seconds = time.perf_counter() - wall
+        record.process_cpu_seconds = time.process_time() - cpu
+        record.rss_end_mb = current_rss_mb()
+        if peak_before is not None:
+            record.peak_rss_increase_mb = peak_rss_mb() - peak_before
+        if tracing:
+            #Peak traced memory above what was allocated when the stage started
+            traced_peak = max(tracemalloc.get_traced_memory()[1], record._traced_peak)
+            record.traced_peak_mb = max(traced_peak - traced_before, 0) / 1024 ** 2
+            if parent is not None:
+                parent._traced_peak = max(parent._traced_peak, traced_peak)
+            tracemalloc.reset_peak()
+        _stage.reset(token)
+
+@contextlib.contextmanager
+def profiling(profile_path=None, tracemalloc_top=0):
+    """
+    Optionally profiles the block with cProfile and traces allocations with tracemalloc. With tracemalloc on, each
+    stage also records the peak memory traced while it ran.
+    INPUT: Path to write cProfile stats to (None disables cProfile), number of top allocation sites to print
+    (0 disables tracemalloc)
+    OUTPUT: None
+    """
+    profiler = cProfile.Profile() if profile_path else None
+    if tracemalloc_top:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+        if tracemalloc_top:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            print('Top {} allocation sites'.format(tracemalloc_top))
+            for stat in snapshot.statistics('lineno')[:tracemalloc_top]:
+                print(stat)
@@ -0,0 +1,135 @@
+"""
+Writes the outputs of the pipeline in several file formats. Parquet, Arrow IPC and CSV files are written in
+batches from Arrow tables, and Excel workbooks are written row by row with XlsxWriter in constant memory mode.
+Several formats can be written at the same time from one set of results.
+"""
+
+#Python libraries
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+import instrumentation
+import tracker_snapshot
+
+#Sheet / file name of each output and the index of its DataFrame in the results of run_etl_pipeline
+OUTPUTS = {'MASTER_Emissions':3, 'PEAKING_Emissions':5}
+
+FORMATS = ['parquet','arrow','csv','xlsx']
+
+def _atomic_path(path):
+    return '{}.{}.tmp'.format(path, os.getpid())
+
+def write_parquet(df, path, batch_rows=65536):
+    """
+    Writes a DataFrame to Parquet, one row group per batch. Column labels are kept in the schema metadata.
+    INPUT: DataFrame, target path, rows per row group
+    OUTPUT: None
+    """
+    table = tracker_snapshot.frame_to_table(df.reset_index(drop=True))
+    with pq.ParquetWriter(_atomic_path(path), table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=batch_rows):
+            writer.write_batch(batch)
+    os.replace(_atomic_path(path), path)
+
+def write_arrow(df, path, batch_rows=65536):
+    """
+    Writes a DataFrame to an Arrow IPC file that can be read with tracker_snapshot.read_frame_snapshot
+    INPUT: DataFrame, target path, rows per record batch
+    OUTPUT: None
+    """
+    table = tracker_snapshot.frame_to_table(df.reset_index(drop=True))
+    with pa.OSFile(_atomic_path(path), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=batch_rows)
+    os.replace(_atomic_path(path), path)
+
+def write_csv(df, path, batch_rows=65536):
+    """
+    Writes a DataFrame to CSV in batches
+    INPUT: DataFrame, target path, rows per batch
+    OUTPUT: None
+    """
+    table = tracker_snapshot.frame_to_table(df.reset_index(drop=True))
+    with pa_csv.CSVWriter(_atomic_path(path), table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=batch_rows):
+            writer.write_batch(batch)
+    os.replace(_atomic_path(path), path)
+
+def write_excel(frames, path, batch_rows=65536):
+    """
+    Writes DataFrames to the sheets of a workbook with XlsxWriter in constant memory mode. Rows are written in
+    order, so only the current row is held by XlsxWriter, and missing values are left blank.
+    INPUT: Dictionary of sheet name to DataFrame, target path, rows converted from the DataFrame at a time
+    OUTPUT: None
+    """
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(_atomic_path(path), {'constant_memory':True, 'nan_inf_to_errors':True})
+    for sheet_name, df in frames.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, list(df.columns))
+        for start in range(0, len(df), batch_rows):
+            values = df.iloc[start:start + batch_rows].to_numpy(dtype=object)
+            values[values != values] = None #NaN is the only value not equal to itself
+            for offset, row in enumerate(values.tolist()):
+                worksheet.write_row(start + offset + 1, 0, row)
+    workbook.close()
+    os.replace(_atomic_path(path), path)
+
+_WRITERS = {'parquet':write_parquet, 'arrow':write_arrow, 'csv':write_csv}
+
+def output_paths(target_path, fmt):
+    """
+    Returns the files written for a format: one workbook for xlsx, one file per output for the other formats
+    INPUT: Target path without extension, format
+    OUTPUT: List of paths
+    """
+    if fmt == 'xlsx':
+        return [target_path + '.xlsx']
+    return ['{}_{}.{}'.format(target_path, name, fmt) for name in OUTPUTS]
+
+def write_format(results, target_path, fmt, batch_rows=65536):
+    """
+    Writes the outputs of a run in one format
+    INPUT: Tuple of 6 DataFrames, target path without extension, format, rows per batch
+    OUTPUT: List of paths written
+    """
+    if fmt not in FORMATS:
+        raise ValueError('Unknown output format {!r}, expected one of {}'.format(fmt, ', '.join(FORMATS)))
+    frames = {name:results[index] for name, index in OUTPUTS.items()}
+    paths = output_paths(target_path, fmt)
+    with instrumentation.stage(fmt, sum(len(df) for df in frames.values())) as s:
+        if fmt == 'xlsx':
+            write_excel(frames, paths[0], batch_rows)
+        else:
+            for df, path in zip(frames.values(), paths):
+                _WRITERS[fmt](df, path, batch_rows)
+        s.rows_out = s.rows_in
+    return paths
+
+def write_outputs(results, target_path, formats=('xlsx',), max_workers=None, batch_rows=65536):
+    """
+    Writes the outputs of a run in several formats at the same time, one thread per format. Arrow and Parquet
+    writing releases the GIL, so the formats overlap rather than queue behind each other.
+    INPUT: Tuple of 6 DataFrames, target path without extension, list of formats, number of threads (defaults to
+    one per format), rows per batch
+    OUTPUT: Dictionary of format to list of paths written
+    """
+    formats = list(dict.fromkeys(formats))
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise ValueError('Unknown output format {!r}, expected one of {}'.format(fmt, ', '.join(FORMATS)))
+    os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+    with instrumentation.stage('write'):
+        if len(formats) <= 1 or max_workers == 1:
+            return {fmt:write_format(results, target_path, fmt, batch_rows) for fmt in formats}
+        with ThreadPoolExecutor(max_workers=max_workers or len(formats)) as executor:
+            #Each thread runs in a copy of the current context so its stage is recorded under 'write'
+            futures = {fmt:executor.submit(contextvars.copy_context().run, write_format, results, target_path, fmt,
+                                           batch_rows)
+                       for fmt in formats}
+            return {fmt:future.result() for fmt, future in futures.items()}
@@ -0,0 +1,118 @@
+"""
+Runs the per-city stages of the peaking analysis across a process pool. The tracker is shared with the workers as a
+memory mapped Arrow file, each task is a contiguous range of cities and the workers return their results as Arrow
+files, so no DataFrames are pickled between processes.
+"""
+
+#Python libraries
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import emissions_analysis as ea
+import tracker_snapshot
+from streaming_pipeline import ID_COLUMNS, year_columns
+
+def shard_cities(df, n_shards):
+    """
+    Splits a DataFrame sorted by City into contiguous row ranges holding whole cities
+    INPUT: DataFrame in the layout returned by read_in_data_from_master_emissions_tracker, number of shards
+    OUTPUT: List of (start, stop) row ranges in City order
+    """
+    city_starts = ea.find_city_starts(df['City'].to_numpy())
+    if len(city_starts) == 0:
+        return []
+    n_shards = max(1, min(n_shards, len(city_starts)))
+    cuts = city_starts[np.linspace(0, len(city_starts), n_shards + 1).astype(int)[:-1]]
+    return list(zip(cuts, np.r_[cuts[1:], len(df)]))
+
+_worker_state = {}
+
+def _initialise_worker(tracker_path, out_dir, columns, current_year, base_year, engine, thresholds,
+                       include_all_sources, trend=False):
+    source = pa.memory_map(tracker_path, 'r')
+    _worker_state['tracker'] = pa.ipc.open_file(source).read_all()
+    _worker_state.update(out_dir=out_dir, columns=columns, current_year=current_year, base_year=base_year,
+                         engine=engine, thresholds=thresholds, include_all_sources=include_all_sources,
+                         trend=trend)
+
+def _process_shard(shard):
+    """
+    Combines data sources and calculates peak emissions for one shard and writes the result to an Arrow file
+    INPUT: Tuple of shard number, first row and end row
+    OUTPUT: Path of the shard's Arrow file
+    """
+    number, start, stop = shard
+    state = _worker_state
+    df1 = tracker_snapshot.table_to_frame(state['tracker'].slice(start, stop - start))
+    df2 = ea.combine_gpc_and_non_gpc_data_sources(df1, state['base_year'], state['current_year'],
+                                                  state['include_all_sources'])
+    df2 = df2.reindex(columns=state['columns'], fill_value=0)
+    df3 = ea.calculate_peak_emissions(df2, state['current_year'], state['engine'], state['thresholds'],
+                                      state['trend'])
+    path = os.path.join(state['out_dir'], 'shard-{:05d}.arrow'.format(number))
+    tracker_snapshot.write_frame_snapshot(df3.reset_index(drop=True), path)
+    return path
+
+def run_stages_in_parallel(df1, current_year, base_year, processes=None, shards_per_process=4, engine='numpy',
+                           thresholds=None, include_all_sources=False, registry=None, trend=False):
+    """
+    Runs combine and peak for shards of cities in a process pool, then selects data sources and reshapes the
+    merged result in this process. Selection is done once over all cities so the peaked city registry is read and
+    updated once, as in a single process run. Shards are merged in City order, so the results do not depend on the
+    number of processes.
+    INPUT: DataFrame returned by read_in_data_from_master_emissions_tracker, current year, base year, number of
+    worker processes (None uses all cores), shards per process, peaking parameter engine, peaking thresholds,
+    whether to include All GPC and non GPC considered rows, optional PeakedCityRegistry, whether to add the trend
+    fit columns
+    OUTPUT: Tuple of 6 DataFrames as returned by run_etl_pipeline
+    """
+    processes = processes or os.cpu_count()
+    columns = ID_COLUMNS + year_columns(sorted(df1['Year'].unique()), base_year, current_year)
+    ranges = shard_cities(df1, processes * shards_per_process)
+
+    with tempfile.TemporaryDirectory(prefix='peaking-') as tmp_dir:
+        tracker_path = os.path.join(tmp_dir, 'tracker.arrow')
+        tracker_snapshot.write_frame_snapshot(df1, tracker_path)
+        initargs = (tracker_path, tmp_dir, columns, current_year, base_year, engine, thresholds, include_all_sources,
+                    trend)
+        tasks = [(number, start, stop) for number, (start, stop) in enumerate(ranges)]
+
+        if processes == 1:
+            _initialise_worker(*initargs)
+            paths = [_process_shard(task) for task in tasks]
+            _worker_state.clear()
+        else:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_initialise_worker,
+                                     initargs=initargs) as executor:
+                paths = list(executor.map(_process_shard, tasks))
+
+        shards = [tracker_snapshot.read_frame_snapshot(path) for path in paths]
+
+    if shards:
+        df3 = pd.concat(shards, ignore_index=True)
+    else:
+        df3 = ea.calculate_peak_emissions(ea.combine_gpc_and_non_gpc_data_sources(df1, base_year, current_year,
+                                                                                include_all_sources),
+                                          current_year, engine, thresholds, trend)
+    df4 = ea.select_cities_to_use_in_dashboard(df3, registry=registry)
+    df5, df6 = ea.reshape_data_for_dashboard(df4)
+    #As in run_etl_pipeline the combined DataFrame is the same object as the peaking DataFrame
+    return (df1, df3, df3, df4, df5, df6)
+
+def run_parallel_pipeline(path, current_year, base_year, former_c40_cities, processes=None, engine='numpy',
+                          thresholds=None, cache_dir=None, include_all_sources=False, registry=None, trend=False):
+    """
+    Parallel version of run_etl_pipeline
+    INPUT: Tracker path, current year, base year, former C40 cities, number of worker processes (None uses all
+    cores), peaking parameter engine, peaking thresholds, optional tracker cache directory, whether to include All
+    GPC and non GPC considered rows, optional PeakedCityRegistry, whether to add the trend fit columns
+    OUTPUT: Tuple of 6 DataFrames
+    """
+    df1 = ea.read_in_data_from_master_emissions_tracker(path, former_c40_cities, cache_dir)
+    return run_stages_in_parallel(df1, current_year, base_year, processes, engine=engine, thresholds=thresholds,
+                                  include_all_sources=include_all_sources, registry=registry, trend=trend)
@@ -0,0 +1,103 @@
+"""
+Registry of cities that have previously peaked their emissions and the data source used to show the peak. The
+registry is a database table read through a pooled SQLAlchemy engine, so any database SQLAlchemy supports can be
+used, including a local SQLite file for offline runs.
+"""
+
+#Python libraries
+import os
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+#Database URL of the registry, e.g. postgresql://user@host/db or sqlite:///peak_registry.db
+REGISTRY_URL_VARIABLE = 'PEAK_REGISTRY_URL'
+
+_engines = {}
+_registries = {}
+
+def get_engine(url, **pool_options):
+    """
+    Returns one pooled engine per database URL so connections are reused across runs in the same process
+    INPUT: Database URL, optional create_engine pool keyword arguments
+    OUTPUT: SQLAlchemy Engine
+    """
+    if url not in _engines:
+        _engines[url] = sa.create_engine(url, pool_pre_ping=True, **pool_options)
+    return _engines[url]
+
+class PeakedCityRegistry(object):
+    """
+    Reads and updates the city_data.city_peak_emissions table. Reads are cached in process for ttl seconds and the
+    cache is cleared whenever the registry is written to. SQLite has no schemas, so the table is used without one.
+    """
+    def __init__(self, url, schema='city_data', table_name='city_peak_emissions', ttl=300):
+        self.engine = get_engine(url)
+        self.schema = None if self.engine.dialect.name == 'sqlite' else schema
+        self.table = sa.Table(table_name, sa.MetaData(schema=self.schema),
+                              sa.Column('c40_city_name', sa.String(255), primary_key=True),
+                              sa.Column('data_source', sa.String(255)))
+        self.ttl = ttl
+        self._cities = None
+        self._loaded_at = None
+
+    def create_table(self):
+        """
+        Creates the registry table if it does not exist, e.g. for a local SQLite registry
+        """
+        self.table.metadata.create_all(self.engine)
+
+    def invalidate(self):
+        self._cities = None
+        self._loaded_at = None
+
+    def read(self):
+        """
+        Returns the cities that have peaked, from the in-process cache if it is younger than the TTL
+        INPUT: None
+        OUTPUT: Dictionary of city name to data source
+        """
+        if self._cities is None or time.monotonic() - self._loaded_at > self.ttl:
+            with self.engine.connect() as conn:
+                rows = conn.execute(self.table.select()).fetchall()
+            self._cities = {row[0]:row[1] for row in rows}
+            self._loaded_at = time.monotonic()
+        return dict(self._cities)
+
+    def upsert(self, cities):
+        """
+        Inserts or updates cities that have peaked in one batched statement. PostgreSQL and SQLite use
+        INSERT ... ON CONFLICT, other databases delete and re-insert the cities in a single transaction.
+        INPUT: Dictionary of city name to data source
+        OUTPUT: None
+        """
+        if not cities:
+            return
+        rows = [{'c40_city_name':city, 'data_source':source} for city, source in cities.items()]
+        insert = {'postgresql':postgresql.insert, 'sqlite':sqlite.insert}.get(self.engine.dialect.name)
+        with self.engine.begin() as conn:
+            if insert is not None:
+                stmt = insert(self.table)
+                stmt = stmt.on_conflict_do_update(index_elements=['c40_city_name'],
+                                                  set_={'data_source':stmt.excluded.data_source})
+                conn.execute(stmt, rows)
+            else:
+                conn.execute(self.table.delete().where(self.table.c.c40_city_name.in_(list(cities))))
+                conn.execute(self.table.insert(), rows)
+        self.invalidate()
+
+def get_registry(url=None, **kwargs):
+    """
+    Returns the registry for a database URL, reusing the registry and its cache within the process
+    INPUT: Database URL (defaults to the PEAK_REGISTRY_URL environment variable), PeakedCityRegistry keyword
+    arguments
+    OUTPUT: PeakedCityRegistry
+    """
+    url = url or os.environ.get(REGISTRY_URL_VARIABLE)
+    if not url:
+        raise ValueError('No peaked city registry configured, set {} to a database URL'.format(REGISTRY_URL_VARIABLE))
+    key = (url, tuple(sorted(kwargs.items())))
+    if key not in _registries:
+        _registries[key] = PeakedCityRegistry(url, **kwargs)
+    return _registries[key]
@@ -0,0 +1,115 @@
+"""
+Scores a grid of peaking thresholds against one set of peaking parameters to test how sensitive the number of
+peaked cities is to the peaking criteria.
+"""
+
+#Python libraries
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+import emissions_analysis as ea
+
+#Columns needed to score peaking thresholds, kept small so they are cheap to send to worker processes
+SWEEP_COLUMNS = ['City','Data source','Num data points','Max emissions','Max emissions year',
+                 'Recent emissions','Recent emissions year']
+
+def build_threshold_grid(grid):
+    """
+    Expands a grid of threshold values into a list of threshold sets
+    INPUT: Dictionary of threshold name to list of values, e.g. {'min_reduction_from_peak':[0.05,0.1,0.15]}
+    OUTPUT: List of threshold dictionaries, one for each grid point
+    """
+    unknown = set(grid) - set(ea.PEAKING_THRESHOLDS)
+    if unknown:
+        raise ValueError('Unknown peaking thresholds: {}'.format(', '.join(sorted(unknown))))
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+def prepare_sweep_parameters(df):
+    """
+    Calculates peaking parameters once for a sweep and orders rows by City and Data quality as in select_cities
+    INPUT: DataFrame returned by combine_gpc_and_non_gpc_data_sources
+    OUTPUT: DataFrame with SWEEP_COLUMNS
+    """
+    df = ea.calculate_peaking_parameters(df.copy())
+    df = df.sort_values(['City','Data quality']).reset_index(drop=True)
+    return df[SWEEP_COLUMNS]
+
+def score_threshold_sets(df, current_year, threshold_sets):
+    """
+    Scores threshold sets and selects a data source and peak status for each city and threshold set
+    INPUT: DataFrame returned by prepare_sweep_parameters, current year, list of threshold dictionaries
+    OUTPUT: Tuple of city status codes and selected row positions, both with shape (threshold sets, cities)
+    """
+    city_starts = ea.find_city_starts(df['City'].to_numpy())
+    codes = ea.evaluate_peak_status_for_threshold_sets(df, current_year, threshold_sets)
+    return ea.select_data_source_for_each_city(city_starts, codes, df['Num data points'].to_numpy())
+
+_worker_state = {}
+
+def _initialise_worker(df, current_year):
+    _worker_state['df'] = df
+    _worker_state['current_year'] = current_year
+
+def _score_chunk(threshold_sets):
+    return score_threshold_sets(_worker_state['df'], _worker_state['current_year'], threshold_sets)
+
+def run_threshold_sweep(df, current_year, grid, processes=None, chunk_size=64):
+    """
+    Scores every point of a threshold grid against the output of combine_gpc_and_non_gpc_data_sources. Peaking
+    parameters are calculated once and the grid is scored in chunks, across a process pool when there is more than
+    one chunk and processes is not 1. City statuses use the select_cities rules but do not apply the peaked city
+    registry reconciliation done by select_cities_to_use_in_dashboard.
+    INPUT: DataFrame returned by combine_gpc_and_non_gpc_data_sources, current year, dictionary of threshold name
+    to list of values, number of worker processes (None uses all cores), grid points per chunk
+    OUTPUT: Tuple of grid DataFrame (one row per grid point) and long DataFrame of Grid point, City, Data source
+    and Peak Status
+    """
+    params = prepare_sweep_parameters(df)
+    threshold_sets = build_threshold_grid(grid)
+    chunks = [threshold_sets[i:i + chunk_size] for i in range(0, len(threshold_sets), chunk_size)]
+
+    if processes == 1 or len(chunks) <= 1:
+        scored = [score_threshold_sets(params, current_year, chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_initialise_worker,
+                                 initargs=(params, current_year)) as executor:
+            scored = list(executor.map(_score_chunk, chunks))
+
+    city = params['City'].to_numpy()
+    n_cities = len(np.unique(city)) if len(city) else 0
+    city_status = np.concatenate([s[0] for s in scored]) if scored else np.empty((0, n_cities), dtype=np.int8)
+    selected = np.concatenate([s[1] for s in scored]) if scored else np.empty((0, n_cities), dtype=np.intp)
+
+    grid_df = pd.DataFrame(threshold_sets)
+    grid_df.insert(0, 'Grid point', np.arange(len(threshold_sets), dtype=np.int32))
+
+    rows = selected.ravel()
+    results = pd.DataFrame({
+        'Grid point':np.repeat(np.arange(len(threshold_sets), dtype=np.int32), n_cities),
+        'City':pd.Categorical(city[rows]),
+        'Data source':pd.Categorical(params['Data source'].to_numpy()[rows]),
+        'Peak Status':pd.Categorical.from_codes(city_status.ravel(), categories=ea.PEAK_STATUSES),
+        })
+    return grid_df, results
+
+def summarise_threshold_sweep(grid_df, results):
+    """
+    Counts cities by peak status for each grid point
+    INPUT: Grid and results DataFrames returned by run_threshold_sweep
+    OUTPUT: Grid DataFrame with a column of city counts for each peak status
+    """
+    counts = results.groupby(['Grid point','Peak Status']).size().unstack(fill_value=0)
+    return grid_df.merge(counts.reset_index(), on='Grid point', how='left')
+
+def write_threshold_sweep(grid_df, results, target_path):
+    """
+    Writes sweep results as Parquet files, '<target_path>_grid.parquet' and '<target_path>_status.parquet'
+    INPUT: Grid and results DataFrames returned by run_threshold_sweep, target path without extension
+    OUTPUT: None
+    """
+    grid_df.to_parquet(target_path + '_grid.parquet', index=False)
+    results.to_parquet(target_path + '_status.parquet', index=False)
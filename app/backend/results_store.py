@@ -0,0 +1,269 @@
+"""
+Persists the results of select_cities_to_use_in_dashboard and reshape_data_for_dashboard as Parquet files and
+queries them lazily. Each file is sorted by City and written in row groups, and a sidecar index records the range
+and the distinct values of the indexed columns in every row group. A query is only a description of the columns and
+predicates wanted until it is read, and then only the row groups the index cannot rule out and only the columns the
+query uses are read from disk. The tracker has no region column, so queries can only be made on the columns of
+the pipeline outputs.
+
+    store = ResultsStore('/data/peaking_analysis/results_store')
+    store.peaked_cities(latest_after=2015)
+    store.series.where('City', '==', 'Accra').where('Data source', '==', 'CDP_Other').select('Year','Emissions').read()
+"""
+
+#Python libraries
+import json
+import operator
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import tracker_snapshot
+
+#Stored tables, the index of their DataFrame in the results of run_etl_pipeline, sort order and indexed columns
+TABLES = {
+    'peaks':{'index':3, 'sort':['City','Data source'],
+             'indexed':['City','Data source','Peak Status','Use for dashboard?','Recent emissions year']},
+    'series':{'index':5, 'sort':['City','Data source','Year'],
+              'indexed':['City','Data source','Peak Status','Year']},
+    }
+
+INDEX_FILE = 'index.json'
+
+#Distinct values are only kept in the index for columns with at most this many values in a row group
+MAX_INDEXED_VALUES = 64
+
+OPERATORS = {'==':operator.eq, '!=':operator.ne, '<':operator.lt, '<=':operator.le, '>':operator.gt,
+             '>=':operator.ge}
+
+def _column_name(label):
+    #Parquet column names are the string form of the DataFrame labels, as written by tracker_snapshot
+    return str(label)
+
+def _row_group_stats(table, columns):
+    """
+    Summarises the indexed columns of one row group
+    INPUT: pyarrow Table holding the row group, list of indexed column names
+    OUTPUT: Dictionary of column name to min, max and, for columns with few values, the sorted distinct values
+    """
+    stats = {}
+    for name in columns:
+        column = table.column(name)
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(column.type.value_type)
+        column = column.drop_null()
+        if len(column) == 0:
+            stats[name] = {'min':None, 'max':None, 'values':[]}
+            continue
+        min_max = pc.min_max(column)
+        entry = {'min':min_max['min'].as_py(), 'max':min_max['max'].as_py()}
+        values = pc.unique(column)
+        if len(values) <= MAX_INDEXED_VALUES:
+            entry['values'] = sorted(values.to_pylist())
+        stats[name] = entry
+    return stats
+
+def write_table(df, path, sort, indexed, row_group_rows=16384):
+    """
+    Writes a DataFrame sorted by the given columns to Parquet, one row group per row_group_rows rows
+    INPUT: DataFrame, target path, sort columns, indexed columns, rows per row group
+    OUTPUT: Dictionary with the file name, number of rows, indexed columns and statistics of each row group
+    """
+    df = df.sort_values(sort, kind='mergesort').reset_index(drop=True)
+    table = tracker_snapshot.frame_to_table(df)
+    row_groups = []
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with pq.ParquetWriter(tmp_path, table.schema) as writer:
+        for start in range(0, max(len(df), 1), row_group_rows):
+            chunk = table.slice(start, row_group_rows)
+            writer.write_table(chunk, row_group_size=row_group_rows)
+            row_groups.append({'rows':len(chunk), 'stats':_row_group_stats(chunk, indexed)})
+    os.replace(tmp_path, path)
+    return {'file':os.path.basename(path), 'rows':len(df), 'indexed':indexed, 'row_groups':row_groups}
+
+def write_results_store(results, store_dir, row_group_rows=16384):
+    """
+    Persists the peaking and long dashboard DataFrames of a run with their sidecar index. The index is written last
+    so a store that is being replaced is never read as complete.
+    INPUT: Tuple of 6 DataFrames returned by run_etl_pipeline, store directory, rows per row group
+    OUTPUT: None
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    index_path = os.path.join(store_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    index = {}
+    for name, spec in TABLES.items():
+        index[name] = write_table(results[spec['index']], os.path.join(store_dir, name + '.parquet'),
+                                  spec['sort'], spec['indexed'], row_group_rows)
+    tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, default=str)
+    os.replace(tmp_path, index_path)
+
+def _may_match(stats, op, value):
+    """
+    Returns False when the statistics of a row group show that no row can match the predicate
+    """
+    if stats['min'] is None:
+        return False
+    if 'values' in stats:
+        if op == 'in':
+            return any(v in value for v in stats['values'])
+        return any(OPERATORS[op](v, value) for v in stats['values'])
+    low, high = stats['min'], stats['max']
+    if op == 'in':
+        return any(low <= v <= high for v in value)
+    if op == '==':
+        return low <= value <= high
+    if op == '<':
+        return low < value
+    if op == '<=':
+        return low <= value
+    if op == '>':
+        return high > value
+    if op == '>=':
+        return high >= value
+    return not (low == high == value)
+
+class Query(object):
+    """
+    Lazy query over one stored table. where and select return new queries and nothing is read until read, count or
+    row_groups is called.
+    """
+    def __init__(self, store, name, predicates=(), columns=None):
+        self.store = store
+        self.name = name
+        self.predicates = tuple(predicates)
+        self.columns = columns
+
+    def where(self, column, op, value):
+        """
+        Adds a predicate. Predicates are combined with and.
+        INPUT: Column label, operator ('==', '!=', '<', '<=', '>', '>=' or 'in'), value or, for 'in', list of values
+        OUTPUT: Query
+        """
+        if op != 'in' and op not in OPERATORS:
+            raise ValueError('Unknown operator {!r}, expected one of {}'.format(op, list(OPERATORS) + ['in']))
+        self.store._check_columns(self.name, [column])
+        value = list(value) if op == 'in' else value
+        return Query(self.store, self.name, self.predicates + ((column, op, value),), self.columns)
+
+    def select(self, *columns):
+        """
+        Restricts the columns returned
+        INPUT: Column labels
+        OUTPUT: Query
+        """
+        self.store._check_columns(self.name, columns)
+        return Query(self.store, self.name, self.predicates, list(columns))
+
+    def row_groups(self):
+        """
+        Lists the row groups that may hold matching rows, using the sidecar index
+        """
+        groups = []
+        for number, group in enumerate(self.store.index[self.name]['row_groups']):
+            if all(_may_match(group['stats'][_column_name(column)], op, value)
+                   for column, op, value in self.predicates if _column_name(column) in group['stats']):
+                groups.append(number)
+        return groups
+
+    def _expression(self):
+        expression = None
+        for column, op, value in self.predicates:
+            field = pc.field(_column_name(column))
+            condition = field.isin(value) if op == 'in' else OPERATORS[op](field, value)
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def read(self):
+        """
+        Runs the query, reading only the row groups that may match and the columns that are selected or filtered on
+        OUTPUT: DataFrame with the original column labels, in the stored order
+        """
+        labels = self.store.labels[self.name]
+        columns = self.columns if self.columns is not None else list(labels.values())
+        names = [_column_name(column) for column in columns]
+        needed = names + [_column_name(column) for column, _, _ in self.predicates
+                          if _column_name(column) not in names]
+        parquet_file = self.store.open(self.name)
+        table = parquet_file.read_row_groups(self.row_groups(), columns=needed)
+        expression = self._expression()
+        if expression is not None:
+            table = table.filter(expression)
+        df = table.select(names).to_pandas(split_blocks=True)
+        df.columns = [labels[name] for name in names]
+        return df
+
+    def count(self):
+        """
+        Counts the matching rows, reading only the columns filtered on
+        """
+        if not self.predicates:
+            return self.store.index[self.name]['rows']
+        return len(Query(self.store, self.name, self.predicates, [self.predicates[0][0]]).read())
+
+class ResultsStore(object):
+    """
+    Read access to a directory written by write_results_store. The tables are 'peaks', one row per City and Data
+    source from select_cities_to_use_in_dashboard, with 'Use for dashboard?' marking the data source shown for each
+    city and the registry reconciliation applied, and 'series', one row per City, Data source and Year from
+    reshape_data_for_dashboard.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = os.path.expanduser(store_dir)
+        with open(os.path.join(self.store_dir, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.labels = {}
+        for name in self.index:
+            schema = pq.read_schema(os.path.join(self.store_dir, self.index[name]['file']))
+            self.labels[name] = tracker_snapshot.column_labels(schema)
+        self._files = {}
+
+    def open(self, name):
+        if name not in self._files:
+            self._files[name] = pq.ParquetFile(os.path.join(self.store_dir, self.index[name]['file']))
+        return self._files[name]
+
+    def _check_columns(self, name, columns):
+        missing = [column for column in columns if _column_name(column) not in self.labels[name]]
+        if missing:
+            raise KeyError('{} not in the {} table, which has columns {}'.format(
+                missing, name, list(self.labels[name].values())))
+
+    def query(self, name):
+        return Query(self, name)
+
+    @property
+    def peaks(self):
+        return Query(self, 'peaks')
+
+    @property
+    def series(self):
+        return Query(self, 'series')
+
+    def peaked_cities(self, latest_after=None):
+        """
+        Lists the cities shown as peaked on the dashboard with the data source used for each, optionally only those
+        whose latest inventory is after the given year
+        INPUT: Year or None
+        OUTPUT: DataFrame of City, Data source, Max emissions year and Recent emissions year, one row per city
+        """
+        query = self.peaks.where('Use for dashboard?', '==', 'yes').where('Peak Status', '==', 'Peaked')
+        if latest_after is not None:
+            query = query.where('Recent emissions year', '>', latest_after)
+        return query.select('City','Data source','Max emissions year','Recent emissions year').read()
+
+    def city_series(self, city, data_source=None):
+        """
+        Returns the emissions series of a city, optionally from one data source
+        INPUT: City, data source or None
+        OUTPUT: DataFrame of Data source, Year and Emissions
+        """
+        query = self.series.where('City', '==', city)
+        if data_source is not None:
+            query = query.where('Data source', '==', data_source)
+        return query.select('Data source','Year','Emissions').read()
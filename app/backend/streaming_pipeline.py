@@ -0,0 +1,208 @@
+"""
+Runs the peaking analysis as a stream of city partitions. Each partition goes through combine, peak, select and
+reshape on its own and its outputs are appended to Parquet files as soon as it is finished, so peak memory depends
+on the partition size and not on the size of the dataset.
+"""
+
+#Python libraries
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import emissions_analysis as ea
+import peak_registry
+import tracker_snapshot
+
+#Outputs written by the streaming pipeline and the index of the matching DataFrame returned by run_etl_pipeline
+STREAM_OUTPUTS = {'selected':3, 'dashboard':4, 'dashboard_all':5}
+
+ID_COLUMNS = ['City','Data source','Data quality']
+
+def prepare_source(path, former_c40_cities=None, cache_dir=None):
+    """
+    Returns the path of a long format source (one row per City, Data source and Year, sorted by City) that can be
+    read in batches. Arrow and Parquet files are used as they are, a tracker workbook is cleaned and written to an
+    Arrow snapshot in the cache directory first.
+    INPUT: Source path (.arrow, .parquet or .xlsx), former C40 cities and cache directory for a workbook
+    OUTPUT: Path of an Arrow or Parquet file
+    """
+    if not path.endswith('.xlsx'):
+        return os.path.expanduser(path)
+    cache_dir = cache_dir or tracker_snapshot.DEFAULT_CACHE_DIR
+    df = ea.read_in_data_from_master_emissions_tracker(path, former_c40_cities or [], cache_dir)
+    key = tracker_snapshot.cache_key(tracker_snapshot.file_fingerprint(path, cache_dir), sorted(former_c40_cities or []))
+    snapshot_path = os.path.join(os.path.expanduser(cache_dir), 'tracker-stream-{}.arrow'.format(key))
+    if not os.path.exists(snapshot_path):
+        tracker_snapshot.write_frame_snapshot(df, snapshot_path)
+    return snapshot_path
+
+def read_years(path):
+    """
+    Reads the distinct inventory years of a source without loading the other columns
+    INPUT: Arrow or Parquet path
+    OUTPUT: Sorted list of years
+    """
+    if path.endswith('.parquet'):
+        years = pq.read_table(path, columns=['Year']).column('Year')
+    else:
+        with pa.memory_map(path, 'r') as source:
+            years = pa.ipc.open_file(source).read_all().column('Year')
+    return sorted(years.unique().to_pylist())
+
+def iter_batches(path, batch_rows=100000):
+    """
+    Yields record batches of at most batch_rows rows. Arrow files are memory mapped and sliced without copying.
+    INPUT: Arrow or Parquet path, rows per batch
+    OUTPUT: Generator of pyarrow RecordBatches
+    """
+    if path.endswith('.parquet'):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+            yield batch
+        return
+    with pa.memory_map(path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for offset in range(0, batch.num_rows, batch_rows):
+                yield batch.slice(offset, batch_rows)
+
+def iter_city_partitions(batches, cities_per_partition):
+    """
+    Groups rows sorted by City into DataFrames holding all rows of up to cities_per_partition cities
+    INPUT: Iterable of record batches sorted by City, number of cities per partition
+    OUTPUT: Generator of DataFrames in the layout returned by read_in_data_from_master_emissions_tracker
+    """
+    pending = None
+    last_city = None
+    for batch in batches:
+        df = tracker_snapshot.table_to_frame(pa.Table.from_batches([batch]))
+        if df.empty:
+            continue
+        if last_city is not None and df['City'].iloc[0] <= last_city:
+            raise ValueError('Streaming source must be sorted by City')
+        pending = df if pending is None else pd.concat([pending, df], ignore_index=True)
+        city = pending['City'].to_numpy()
+        starts = ea.find_city_starts(city)
+        #The last city may continue in the next batch, so only complete cities are released
+        while len(starts) > cities_per_partition:
+            cut = starts[cities_per_partition]
+            yield pending.iloc[:cut].reset_index(drop=True)
+            last_city = city[cut - 1]
+            pending = pending.iloc[cut:].reset_index(drop=True)
+            city = city[cut:]
+            starts = starts[cities_per_partition:] - cut
+    if pending is not None and len(pending):
+        yield pending
+
+def year_columns(years, base_year, current_year):
+    """
+    Returns the year columns of combine_gpc_and_non_gpc_data_sources for the whole dataset, in the same order
+    INPUT: Inventory years of the dataset, base year, current year
+    OUTPUT: List of year column labels
+    """
+    columns = list(years)
+    columns += [float(year) for year in range(base_year, current_year + 1) if year not in columns]
+    return columns
+
+def process_partition(df1, columns, current_year, base_year, engine='numpy', thresholds=None,
+                      include_all_sources=False, cities=None, trend=False):
+    """
+    Runs combine, peak, select and reshape for one city partition. Newly peaked cities are not reported or added to
+    the registry here, as run_streaming_pipeline does that once for all partitions.
+    INPUT: Partition DataFrame, combined DataFrame columns for the whole dataset, run settings, dictionary of cities
+    that have previously peaked, whether to add the trend fit columns
+    OUTPUT: Tuple of 6 DataFrames as returned by run_etl_pipeline
+    """
+    df2 = ea.combine_gpc_and_non_gpc_data_sources(df1, base_year, current_year, include_all_sources)
+    #Years without an inventory in this partition are zero, as they are in a full run
+    df2 = df2.reindex(columns=columns, fill_value=0)
+    df3 = ea.calculate_peak_emissions(df2, current_year, engine, thresholds, trend)
+    df4 = ea.select_cities_to_use_in_dashboard(df3, cities, report=False)
+    df5, df6 = ea.reshape_data_for_dashboard(df4)
+    return (df1, df2, df3, df4, df5, df6)
+
+class PartitionWriter(object):
+    """
+    Appends DataFrames to a Parquet file, one row group per partition. The schema is taken from the first partition
+    and later partitions are cast to it, so columns that are empty in one partition do not change the file schema.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        self.writer = None
+        self.rows = 0
+
+    def write(self, df):
+        table = tracker_snapshot.frame_to_table(df.reset_index(drop=True))
+        if self.writer is None:
+            #Categorical codes are int8 or int16 depending on the number of categories in the partition, so
+            #dictionary columns are widened to int32 indices for every partition
+            schema = pa.schema([field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+                                if pa.types.is_dictionary(field.type) else field for field in table.schema],
+                               metadata=table.schema.metadata)
+            self.writer = pq.ParquetWriter(self.tmp_path, schema)
+        table = table.select(self.writer.schema.names).cast(self.writer.schema)
+        self.writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+            os.remove(self.tmp_path)
+
+def read_stream_output(path):
+    """
+    Reads a Parquet file written by the streaming pipeline back with its original column labels
+    INPUT: Parquet path
+    OUTPUT: DataFrame
+    """
+    return tracker_snapshot.table_to_frame(pq.read_table(path))
+
+def run_streaming_pipeline(path, target_path, current_year, base_year, former_c40_cities=None, engine='numpy',
+                           thresholds=None, include_all_sources=False, registry=None, cache_dir=None,
+                           cities_per_partition=500, batch_rows=100000, trend=False):
+    """
+    Runs the ETL pipeline one city partition at a time and writes the selected, dashboard and long dashboard
+    DataFrames to '<target_path>_<output>.parquet'. Cities that have previously peaked are read from the registry
+    once, before the first partition, and newly peaked cities are collected across partitions and reported and added
+    to the registry once, after the last. The files are only moved into place once every partition has been written.
+    INPUT: Source path (Arrow or Parquet file sorted by City in the layout returned by
+    read_in_data_from_master_emissions_tracker, or a tracker workbook), target path without extension, current
+    year, base year, former C40 cities, peaking parameter engine, peaking thresholds, whether to include All GPC and
+    non GPC considered rows, optional PeakedCityRegistry, cache directory for a workbook, cities per partition, rows
+    read per batch, whether to add the trend fit columns
+    OUTPUT: Dictionary with the number of partitions, cities and rows written to each output
+    """
+    source = prepare_source(path, former_c40_cities, cache_dir)
+    columns = ID_COLUMNS + year_columns(read_years(source), base_year, current_year)
+    registry = registry if registry is not None else peak_registry.get_registry()
+    cities = registry.read()
+
+    writers = {name:PartitionWriter('{}_{}.parquet'.format(target_path, name)) for name in STREAM_OUTPUTS}
+    partitions, n_cities, new_cities = 0, 0, {}
+    try:
+        for df1 in iter_city_partitions(iter_batches(source, batch_rows), cities_per_partition):
+            results = process_partition(df1, columns, current_year, base_year, engine, thresholds,
+                                        include_all_sources, cities, trend)
+            #Partitions hold whole cities, so each newly peaked city is found in exactly one partition
+            new_cities.update(ea.find_new_peaked_cities(results[3], cities))
+            for name, index in STREAM_OUTPUTS.items():
+                writers[name].write(results[index])
+            partitions += 1
+            n_cities += df1['City'].nunique()
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    for writer in writers.values():
+        writer.close()
+    ea.report_new_peaked_cities(new_cities, registry)
+    return {'partitions':partitions, 'cities':n_cities,
+            'rows':{name:writer.rows for name, writer in writers.items()}}
@@ -0,0 +1,171 @@
+"""
+Caches Excel inputs and intermediate DataFrames as Arrow snapshots so that unchanged workbooks are only parsed once.
+Snapshots are keyed by the content hash of the source workbook and are read back through a memory map.
+"""
+
+#Python libraries
+import hashlib
+import json
+import os
+
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+
+DEFAULT_CACHE_DIR = os.environ.get('PEAKING_CACHE_DIR', os.path.join('~', '.cache', 'peaking_analysis'))
+
+#Schema metadata key used to restore non-string column labels such as the float year columns
+LABELS_KEY = b'peaking_analysis.column_labels'
+
+def file_fingerprint(path, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the content hash of a file. Hashes are remembered against the file's mtime and size in the cache
+    directory so an unchanged file is not read again to check it.
+    INPUT: File path, cache directory
+    OUTPUT: Hex SHA-256 digest of the file contents
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    cache_dir = os.path.expanduser(cache_dir)
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir, 'fingerprints.json')
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    entry = index.get(path)
+    if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+        return entry['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    index[path] = {'mtime_ns':stat.st_mtime_ns, 'size':stat.st_size, 'sha256':digest.hexdigest()}
+    os.makedirs(cache_dir, exist_ok=True)
+    _atomic_write_text(index_path, json.dumps(index, indent=1))
+    return digest.hexdigest()
+
+def cache_key(*parts):
+    """
+    Combines values into a short key for a snapshot file name
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:20]
+
+def _encode_label(label):
+    if isinstance(label, (bool, np.bool_)):
+        return ['bool', bool(label)]
+    if isinstance(label, (int, np.integer)):
+        return ['int', int(label)]
+    if isinstance(label, (float, np.floating)):
+        return ['float', float(label)]
+    return ['str', str(label)]
+
+def _decode_label(encoded):
+    kind, value = encoded
+    return {'bool':bool, 'int':int, 'float':float, 'str':str}[kind](value)
+
+def frame_to_table(df):
+    """
+    Converts a DataFrame to an Arrow table, storing the original column labels in the schema metadata
+    INPUT: DataFrame
+    OUTPUT: pyarrow Table
+    """
+    labels = [_encode_label(label) for label in df.columns]
+    #A shallow copy so the caller's column labels are left as they are
+    df = df.copy(deep=False)
+    df.columns = [str(label) for label in df.columns]
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[LABELS_KEY] = json.dumps(labels).encode('utf-8')
+    return table.replace_schema_metadata(metadata)
+
+def column_labels(schema):
+    """
+    Returns the original column labels stored by frame_to_table, keyed by the Arrow column name
+    INPUT: pyarrow Schema
+    OUTPUT: Dictionary of column name to label
+    """
+    metadata = schema.metadata or {}
+    if LABELS_KEY not in metadata:
+        return {name:name for name in schema.names}
+    labels = [_decode_label(label) for label in json.loads(metadata[LABELS_KEY])]
+    return dict(zip(schema.names, labels))
+
+def table_to_frame(table):
+    """
+    Converts an Arrow table written by frame_to_table back to a DataFrame with the original column labels
+    INPUT: pyarrow Table
+    OUTPUT: DataFrame
+    """
+    df = table.to_pandas(split_blocks=True)
+    metadata = table.schema.metadata or {}
+    if LABELS_KEY in metadata:
+        df.columns = [_decode_label(label) for label in json.loads(metadata[LABELS_KEY])]
+    return df
+
+def write_frame_snapshot(df, path):
+    """
+    Writes a DataFrame to an uncompressed Arrow IPC file. The file is written to a temporary path and moved into
+    place so readers never see a partly written snapshot.
+    INPUT: DataFrame, target path
+    OUTPUT: None
+    """
+    table = frame_to_table(df)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def read_frame_snapshot(path):
+    """
+    Reads a snapshot written by write_frame_snapshot through a memory map
+    INPUT: Snapshot path
+    OUTPUT: DataFrame
+    """
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table_to_frame(table)
+
+def cached_frame(cache_dir, name, key, build):
+    """
+    Returns the snapshot '<name>-<key>.arrow' from the cache directory, building and writing it first if it does
+    not exist. Older snapshots with the same name are removed.
+    INPUT: Cache directory, snapshot name, cache key, function returning the DataFrame to cache
+    OUTPUT: DataFrame
+    """
+    cache_dir = os.path.expanduser(cache_dir)
+    path = os.path.join(cache_dir, '{}-{}.arrow'.format(name, key))
+    if os.path.exists(path):
+        return read_frame_snapshot(path)
+
+    df = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    write_frame_snapshot(df, path)
+    for f in os.listdir(cache_dir):
+        if f.startswith(name + '-') and f.endswith('.arrow') and f != os.path.basename(path):
+            os.remove(os.path.join(cache_dir, f))
+    return df
+
+def read_excel_snapshot(path, sheet_name, cache_dir=DEFAULT_CACHE_DIR, columns=None, **kwargs):
+    """
+    Reads an Excel sheet, parsing the workbook only when its contents have changed since the last read
+    INPUT: Workbook path, sheet name, cache directory, optional list of columns to keep, pd.read_excel keyword
+    arguments
+    OUTPUT: DataFrame
+    """
+    def build():
+        df = pd.read_excel(path, sheet_name=sheet_name, **kwargs)
+        return df[columns] if columns is not None else df
+
+    key = cache_key(file_fingerprint(path, cache_dir), sheet_name, columns, kwargs)
+    name = 'excel-{}'.format(cache_key(os.path.abspath(os.path.expanduser(path)), sheet_name))
+    return cached_frame(cache_dir, name, key, build)
+
+def _atomic_write_text(path, text):
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
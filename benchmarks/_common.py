@@ -0,0 +1,80 @@
+"""
+Shared helpers for the benchmark scripts and tests: import path set up, synthetic emissions data and peaked city
+registries.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'backend')
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+DATA_SOURCES = {'C40_GPC':1,'City_GPC':2,'CDP_GPC':3,'Target_Other':5,'City_Other':6,'CDP_Other':7}
+
+def make_wide_emissions(n_series, base_year=1990, current_year=2019, sparsity=0.7, seed=0):
+    """
+    Builds a synthetic frame in the shape returned by combine_gpc_and_non_gpc_data_sources: one row per city and
+    data source with a float column per year and zeros where no inventory is available.
+    INPUT: Number of series, year range, fraction of missing inventories or a (low, high) range the fraction of each
+    city is drawn from, random seed
+    OUTPUT: DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    years = np.arange(base_year, current_year + 1, dtype=float)
+    sources = list(DATA_SOURCES)
+    walk = rng.normal(0, 0.05, size=(n_series, len(years))).cumsum(axis=1)
+    values = rng.uniform(1e5, 5e7, size=(n_series, 1)) * np.exp(walk)
+    if isinstance(sparsity, tuple):
+        #Cities with few inventories only have Unknown data sources, often with the same number of data points
+        n_cities = -(-n_series // len(sources))
+        sparsity = np.repeat(rng.uniform(*sparsity, size=n_cities), len(sources))[:n_series, None]
+    values[rng.random(values.shape) < sparsity] = 0
+    df = pd.DataFrame(values, columns=years)
+    source = np.array(sources)[np.arange(n_series) % len(sources)]
+    df.insert(0, 'City', ['City {:07d}'.format(i // len(sources)) for i in range(n_series)])
+    df.insert(1, 'Data source', source)
+    df.insert(2, 'Data quality', [DATA_SOURCES[s] for s in source])
+    return df
+
+def make_long_tracker(n_cities, base_year=1990, current_year=2019, sparsity=0.7, seed=0):
+    """
+    Builds a synthetic frame in the shape returned by read_in_data_from_master_emissions_tracker: one row per city,
+    data source and inventory year, sorted by City and Year.
+    INPUT: Number of cities, year range, fraction of missing inventories, random seed
+    OUTPUT: DataFrame
+    """
+    df = make_wide_emissions(n_cities * len(DATA_SOURCES), base_year, current_year, sparsity, seed)
+    df = df.melt(id_vars=['City','Data source','Data quality'], var_name='Year', value_name='Emissions')
+    df = df[df['Emissions'] != 0]
+    df['Year'] = df['Year'].astype(float)
+    return df.sort_values(['City','Year'], kind='mergesort').reset_index(drop=True)
+
+def make_registry(directory, name, cities=None):
+    """
+    Creates a SQLite peaked city registry in a directory, e.g. one per run being compared
+    INPUT: Directory, database name, optional dictionary of previously peaked cities and their data sources
+    OUTPUT: PeakedCityRegistry
+    """
+    import peak_registry
+    registry = peak_registry.PeakedCityRegistry('sqlite:///' + os.path.join(directory, name + '.db'))
+    registry.create_table()
+    if cities:
+        registry.upsert(cities)
+    return registry
+
+def timeit(func, *args, repeat=1, **kwargs):
+    """
+    Returns the best wall time in seconds over repeat calls of func, and the result of the last call
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
@@ -0,0 +1,81 @@
+"""
+Compares write time and file size of each output format on synthetic pipeline results, against the original
+pd.ExcelWriter path, and times all formats written one after the other and in parallel. Parquet and Arrow outputs
+are read back and checked against the DataFrames they were written from.
+
+    python benchmarks/bench_output_formats.py --cities 2000
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from _common import make_long_tracker, timeit
+import emissions_analysis as ea
+import output_writers
+import tracker_snapshot
+
+CURRENT_YEAR = 2019
+BASE_YEAR = 1990
+
+def make_results(n_cities):
+    df1 = make_long_tracker(n_cities)
+    df2 = ea.combine_gpc_and_non_gpc_data_sources(df1, BASE_YEAR, CURRENT_YEAR)
+    df3 = ea.calculate_peak_emissions(df2, CURRENT_YEAR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        df4 = ea.select_cities_to_use_in_dashboard(df3, cities={})
+    df5, df6 = ea.reshape_data_for_dashboard(df4)
+    return (df1, df2, df3, df4, df5, df6)
+
+def write_pandas_excel(results, path):
+    """
+    Original write_to_excel, with writer.close() in place of the removed writer.save()
+    """
+    writer = pd.ExcelWriter(path, engine='xlsxwriter')
+    results[3].to_excel(writer, sheet_name='MASTER_Emissions', index = False)
+    results[5].to_excel(writer, sheet_name='PEAKING_Emissions', index = False)
+    writer.close()
+
+def check_round_trip(results, target_path):
+    for name, index in output_writers.OUTPUTS.items():
+        expected = results[index].reset_index(drop=True)
+        arrow = tracker_snapshot.read_frame_snapshot('{}_{}.arrow'.format(target_path, name))
+        parquet = tracker_snapshot.table_to_frame(pq.read_table('{}_{}.parquet'.format(target_path, name)))
+        pd.testing.assert_frame_equal(expected, arrow)
+        pd.testing.assert_frame_equal(expected, parquet)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, default=2000)
+    parser.add_argument('--skip-pandas-excel', action='store_true', help='Skip the original pd.ExcelWriter path')
+    args = parser.parse_args()
+
+    results = make_results(args.cities)
+    print('{} cities: MASTER {} rows, PEAKING {} rows'.format(args.cities, len(results[3]), len(results[5])))
+    print('{:<22} {:>10} {:>10}'.format('format', 'seconds', 'MB'))
+    with tempfile.TemporaryDirectory() as directory:
+        if not args.skip_pandas_excel:
+            path = os.path.join(directory, 'pandas.xlsx')
+            seconds, _ = timeit(write_pandas_excel, results, path)
+            print('{:<22} {:>10.2f} {:>10.1f}'.format('xlsx (pd.ExcelWriter)', seconds, os.path.getsize(path) / 1e6))
+
+        target_path = os.path.join(directory, 'run')
+        sequential = 0
+        for fmt in output_writers.FORMATS:
+            seconds, paths = timeit(output_writers.write_format, results, target_path, fmt)
+            sequential += seconds
+            size = sum(os.path.getsize(path) for path in paths) / 1e6
+            print('{:<22} {:>10.2f} {:>10.1f}'.format(fmt, seconds, size))
+        check_round_trip(results, target_path)
+
+        seconds, _ = timeit(output_writers.write_outputs, results, target_path, output_writers.FORMATS)
+        print('{:<22} {:>10.2f}'.format('all, one at a time', sequential))
+        print('{:<22} {:>10.2f}'.format('all, in parallel', seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Measures how run_stages_in_parallel scales from 1 to N processes on a synthetic tracker, and checks that every
+process count gives the same results as the single process pipeline.
+
+    python benchmarks/bench_parallel_scaling.py --cities 5000 --processes 1 2 4 8
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+
+import pandas as pd
+
+from _common import make_long_tracker, make_registry, timeit
+import emissions_analysis as ea
+import parallel_pipeline
+
+CURRENT_YEAR = 2019
+BASE_YEAR = 1990
+
+def run_single_process(df1, registry):
+    df2 = ea.combine_gpc_and_non_gpc_data_sources(df1, BASE_YEAR, CURRENT_YEAR)
+    df3 = ea.calculate_peak_emissions(df2, CURRENT_YEAR)
+    df4 = ea.select_cities_to_use_in_dashboard(df3, registry=registry)
+    df5, df6 = ea.reshape_data_for_dashboard(df4)
+    return (df1, df2, df3, df4, df5, df6)
+
+def check_results_match(expected, results):
+    #Peaking rows are compared in City and Data quality order, selected and dashboard rows as returned
+    pd.testing.assert_frame_equal(expected[2].reset_index(drop=True), results[2].reset_index(drop=True))
+    for index in [3, 4, 5]:
+        pd.testing.assert_frame_equal(expected[index].reset_index(drop=True), results[index].reset_index(drop=True))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, default=5000)
+    parser.add_argument('--processes', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    df1 = make_long_tracker(args.cities)
+    print('{} cities, {} tracker rows, {} cores'.format(args.cities, len(df1), os.cpu_count()))
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        baseline, expected = timeit(run_single_process, df1, make_registry(directory, 'baseline'))
+        timings = []
+        for processes in args.processes:
+            seconds, results = timeit(parallel_pipeline.run_stages_in_parallel, df1, CURRENT_YEAR, BASE_YEAR,
+                                      processes, registry=make_registry(directory, str(processes)))
+            check_results_match(expected, results)
+            timings.append((processes, seconds))
+
+    print('{:>10} {:>10} {:>10}'.format('processes', 'seconds', 'speed up'))
+    print('{:>10} {:>10.2f} {:>10}'.format('baseline', baseline, '1.00x'))
+    for processes, seconds in timings:
+        print('{:>10} {:>10.2f} {:>9.2f}x'.format(processes, seconds, baseline / seconds))
+
+if __name__ == '__main__':
+    main()
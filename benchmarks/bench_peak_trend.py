@@ -0,0 +1,102 @@
+"""
+Benchmarks fit_peak_trend against a per series loop of least squares fits, checks that both give the same peak
+years, confidences and statuses, and compares the trend status with the Peak Status of the peaking criteria.
+
+    python benchmarks/bench_peak_trend.py --series 1000 10000 100000 --loop-series 500
+"""
+
+import argparse
+import contextlib
+import io
+import math
+
+import numpy as np
+import pandas as pd
+
+from _common import make_wide_emissions, timeit
+import emissions_analysis as ea
+import synthetic_tracker
+
+CURRENT_YEAR = 2019
+BASE_YEAR = 1990
+
+def loop_peak_trend(df, min_side=2, min_confidence=0.9):
+    """
+    Reference fit_peak_trend: one np.linalg.lstsq fit per series and breakpoint
+    """
+    year_cols = sorted(col for col in df.columns if not isinstance(col, str))
+    years = np.array(year_cols, dtype=float)
+    peak_years, confidences, statuses = [], [], []
+    for values in df[year_cols].to_numpy(dtype=float):
+        observed = values > 0
+        t, y = years[observed], values[observed] / values[observed].max() if observed.any() else values[observed]
+        best = None
+        for breakpoint in years:
+            before, after = (t <= breakpoint).sum(), (t >= breakpoint).sum()
+            if len(t) < 4 or before < min_side or after < min_side:
+                continue
+            features = np.column_stack([np.ones(len(t)), np.minimum(t - breakpoint, 0), np.maximum(t - breakpoint, 0)])
+            gram = features.T @ features
+            if abs(np.linalg.det(gram)) < 1e-12:
+                continue
+            beta = np.linalg.lstsq(features, y, rcond=None)[0]
+            sse = ((y - features @ beta) ** 2).sum()
+            if best is None or sse < best[0]:
+                best = (sse, breakpoint, beta, np.linalg.inv(gram)[2, 2])
+        if best is None:
+            peak_years.append(np.nan)
+            confidences.append(np.nan)
+            statuses.append(2)
+            continue
+        sse, breakpoint, beta, var = best
+        se = math.sqrt(sse / (len(t) - 3) * var)
+        confidence = 0.5 * math.erfc(beta[2] / se / math.sqrt(2)) if se > 0 else 0.5 * (1 - np.sign(beta[2]))
+        if beta[2] < 0:
+            peak_years.append(breakpoint if beta[1] > 0 else t[0])
+        else:
+            peak_years.append(np.nan)
+        confidences.append(confidence)
+        statuses.append(0 if beta[2] < 0 and confidence >= min_confidence else 1 if confidence <= 1 - min_confidence
+                        else 2)
+    return {'year':np.array(peak_years), 'confidence':np.array(confidences), 'status':np.array(statuses, np.int8)}
+
+def compare_with_criteria(n_cities):
+    """
+    Runs the pipeline with trend=True on a synthetic tracker and counts series by criteria and trend status
+    """
+    raw = synthetic_tracker.make_tracker(n_cities)
+    former_c40_cities = ['Basel','Caracas']
+    df1 = ea.clean_master_emissions_tracker(raw, former_c40_cities)
+    df2 = ea.combine_gpc_and_non_gpc_data_sources(df1, BASE_YEAR, CURRENT_YEAR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        df3 = ea.calculate_peak_emissions(df2, CURRENT_YEAR, trend=True)
+    return pd.crosstab(df3['Peak Status'], df3['Trend Peak Status'], margins=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--series', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--loop-series', type=int, default=500, help='Largest size the per series loop is run for')
+    parser.add_argument('--cities', type=int, default=2000, help='Cities in the criteria comparison')
+    args = parser.parse_args()
+
+    print('{:>8} {:>10} {:>10} {:>10}'.format('series', 'loop s', 'numpy s', 'speed up'))
+    for n_series in args.series:
+        df = make_wide_emissions(n_series)
+        numpy_seconds, result = timeit(ea.fit_peak_trend, df, repeat=3)
+        loop_seconds = None
+        if n_series <= args.loop_series:
+            loop_seconds, expected = timeit(loop_peak_trend, df)
+            np.testing.assert_allclose(result['year'], expected['year'])
+            #fit_peak_trend uses a rational approximation of erfc with an absolute error below 1.5e-7
+            np.testing.assert_allclose(result['confidence'], expected['confidence'], rtol=0, atol=1e-7)
+            np.testing.assert_array_equal(result['status'], expected['status'])
+        print('{:>8} {:>10} {:>10.3f} {:>10}'.format(
+            n_series, '{:.2f}'.format(loop_seconds) if loop_seconds else '-', numpy_seconds,
+            '{:.0f}x'.format(loop_seconds / numpy_seconds) if loop_seconds else '-'))
+
+    print()
+    print('Peak Status (rows) against Trend Peak Status (columns), {} synthetic cities'.format(args.cities))
+    print(compare_with_criteria(args.cities))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+Benchmarks the numpy and pandas engines of calculate_peaking_parameters and checks that they agree.
+
+    python benchmarks/bench_peaking_parameters.py --sizes 100 10000 1000000
+"""
+
+import argparse
+
+import pandas as pd
+
+from _common import make_wide_emissions, timeit
+import emissions_analysis as ea
+
+def run(sizes, legacy_limit):
+    print('{:>10} {:>12} {:>12} {:>10}'.format('series', 'numpy (s)', 'pandas (s)', 'speedup'))
+    for n in sizes:
+        df = make_wide_emissions(n)
+        t_numpy, fast = timeit(lambda: ea.calculate_peaking_parameters(df.copy(), 'numpy'), repeat=3)
+        if n > legacy_limit:
+            print('{:>10} {:>12.4f} {:>12} {:>10}'.format(n, t_numpy, 'skipped', '-'))
+            continue
+        t_pandas, slow = timeit(lambda: ea.calculate_peaking_parameters(df.copy(), 'pandas'))
+        pd.testing.assert_frame_equal(fast, slow)
+        print('{:>10} {:>12.4f} {:>12.4f} {:>9.0f}x'.format(n, t_numpy, t_pandas, t_pandas / t_numpy))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000, 1000000])
+    parser.add_argument('--legacy-limit', type=int, default=100000,
+                        help='Largest number of series to run through the row-wise pandas engine (about 5 minutes at 1M)')
+    args = parser.parse_args()
+    run(args.sizes, args.legacy_limit)
@@ -0,0 +1,70 @@
+"""
+Benchmarks the columnar peaking criteria and status evaluation against the original row-wise implementation, for a
+single threshold set and for a batch of threshold sets.
+
+    python benchmarks/bench_peaking_status.py --sizes 100 10000 100000 --threshold-sets 45
+"""
+
+import argparse
+import itertools
+
+import numpy as np
+
+from _common import make_wide_emissions, timeit
+import emissions_analysis as ea
+
+def row_wise_peak_status(df, current_year, thresholds):
+    """
+    Original apply_peaking_criteria and row-wise evaluate_peaking_criteria with the thresholds made configurable
+    """
+    t = dict(ea.PEAKING_THRESHOLDS, **thresholds)
+    df['PC1'] = (df['Num data points'] >= t['min_data_points'])
+    df['PC2'] = (df['Recent emissions year'] - df['Max emissions year'] >= t['min_years_since_peak'])
+    df['PC3'] = (current_year - df['Recent emissions year'] <= t['max_inventory_age'])
+    df['PC4'] = ((df['Max emissions']-df['Recent emissions'])/df['Max emissions']) >= t['min_reduction_from_peak']
+
+    def evaluate_peaking_criteria(x):
+        if x['PC1'] & x['PC2'] & x['PC3'] & x['PC4']:
+            return 'Peaked'
+        elif x['PC1'] & x['PC3'] & (not x['PC4']):
+            return 'Not Peaked'
+        else:
+            return 'Unknown'
+
+    return df.apply(evaluate_peaking_criteria, axis = 1).to_numpy()
+
+def columnar_peak_status(df, current_year, thresholds):
+    criteria = ea.evaluate_peaking_criteria(df, current_year, thresholds)
+    codes = ea.classify_peak_status(criteria['PC1'], criteria['PC2'], criteria['PC3'], criteria['PC4'])
+    return np.take(ea.PEAK_STATUSES, codes)
+
+def threshold_grid(n_sets):
+    grid = itertools.product([2, 3, 4], [3, 4, 5, 6, 7], [3, 5, 7], [0.05, 0.1, 0.15])
+    keys = ['min_data_points', 'min_years_since_peak', 'max_inventory_age', 'min_reduction_from_peak']
+    return [dict(zip(keys, values)) for values in itertools.islice(grid, n_sets)]
+
+def run(sizes, n_sets, current_year):
+    threshold_sets = threshold_grid(n_sets)
+    print('{:>8} {:>6} {:>14} {:>14} {:>10}'.format('series', 'sets', 'columnar (s)', 'row-wise (s)', 'speedup'))
+    for n in sizes:
+        params = ea.calculate_peaking_parameters(make_wide_emissions(n), 'numpy')
+
+        t_fast, fast = timeit(columnar_peak_status, params, current_year, {}, repeat=3)
+        t_slow, slow = timeit(row_wise_peak_status, params.copy(), current_year, {})
+        assert (fast == slow).all()
+        print('{:>8} {:>6} {:>14.4f} {:>14.4f} {:>9.0f}x'.format(n, 1, t_fast, t_slow, t_slow / t_fast))
+
+        t_batch, batch = timeit(ea.evaluate_peak_status_for_threshold_sets, params, current_year, threshold_sets)
+        for i in (0, len(threshold_sets) - 1):
+            assert (np.take(ea.PEAK_STATUSES, batch[i]) == row_wise_peak_status(params.copy(), current_year, threshold_sets[i])).all()
+        t_loop = t_slow * len(threshold_sets)
+        print('{:>8} {:>6} {:>14.4f} {:>13.1f}* {:>9.0f}x'.format(n, len(threshold_sets), t_batch, t_loop, t_loop / t_batch))
+    print('* row-wise time for a batch is extrapolated from the single threshold set')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000, 100000])
+    parser.add_argument('--threshold-sets', type=int, default=45)
+    parser.add_argument('--current-year', type=int, default=2019)
+    args = parser.parse_args()
+    run(args.sizes, args.threshold_sets, args.current_year)
@@ -0,0 +1,72 @@
+"""
+Benchmarks reshape_data_for_dashboard against the original melt and row-wise apply, compares the memory used by the
+long DataFrame and checks that both produce the same rows.
+
+    python benchmarks/bench_reshape.py --cities 100 1000 5000
+"""
+
+import argparse
+import contextlib
+import io
+
+import pandas as pd
+
+from _common import make_long_tracker, timeit
+import emissions_analysis as ea
+
+def apply_reshape(df):
+    """
+    Original reshape_data_for_dashboard, with the peaking criteria labels taken from criteria_labels
+    """
+    cols = df.columns.difference(['Verified by city','Num data points', 'Max emissions', 'Recent emissions',
+                                  'Earliest emissions', 'Earliest emissions year',
+                                  'Recent emissions year', *ea.criteria_labels().values(),
+                                  'Percentage change since peak (%)',
+                                  'Kaya identity used?','Num modelled data points'])
+    df = df[cols]
+    df = pd.melt(df, id_vars=["City", "Data source", "Data quality","Peak Status", "Max emissions year","Use for dashboard?"], var_name="Year", value_name="Emissions").sort_values(['City', 'Year']).reset_index(drop=True)
+    df['Peak year'] = df.apply(lambda x : 1 if x['Max emissions year'] == x['Year'] and x['Peak Status'] == 'Peaked' else 0, axis=1)
+    df.drop('Max emissions year', axis = 1, inplace = True)
+
+    df1 = df.copy()
+    df2 = df.copy()
+
+    df1 = df1[df1['Use for dashboard?'] == 'yes']
+    df1 = df1.drop('Use for dashboard?',axis=1)
+
+    return df1, df2
+
+def normalise(df):
+    """
+    Converts to the original dtypes and orders rows by City, Year and Data source. The original sort leaves rows of
+    the same City and Year in no fixed order.
+    """
+    df = df.astype({col:object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+    df = df.astype({'Year':float, 'Data quality':'int64', 'Peak year':'int64'})
+    return df.sort_values(['City','Year','Data source']).reset_index(drop=True)
+
+def make_selected(n_cities):
+    df1 = make_long_tracker(n_cities)
+    df3 = ea.calculate_peak_emissions(ea.combine_gpc_and_non_gpc_data_sources(df1, 1990, 2019), 2019)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ea.select_cities_to_use_in_dashboard(df3, cities={})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, nargs='+', default=[100, 1000, 5000])
+    args = parser.parse_args()
+
+    print('{:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format('cities', 'long rows', 'apply s', 'numpy s',
+                                                                     'speed up', 'apply MB', 'numpy MB'))
+    for n_cities in args.cities:
+        df = make_selected(n_cities)
+        apply_seconds, expected = timeit(lambda: apply_reshape(df.copy()))
+        numpy_seconds, results = timeit(ea.reshape_data_for_dashboard, df, repeat=3)
+        for left, right in zip(expected, results):
+            pd.testing.assert_frame_equal(normalise(left), normalise(right))
+        print('{:>8} {:>10} {:>10.3f} {:>10.4f} {:>9.0f}x {:>10.1f} {:>10.1f}'.format(
+            n_cities, len(results[1]), apply_seconds, numpy_seconds, apply_seconds / numpy_seconds,
+            expected[1].memory_usage(deep=True).sum() / 1e6, results[1].memory_usage(deep=True).sum() / 1e6))
+
+if __name__ == '__main__':
+    main()
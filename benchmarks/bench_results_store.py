@@ -0,0 +1,70 @@
+"""
+Benchmarks queries on the results store against reading the whole Parquet output and filtering it in pandas, checks
+that both return the same rows and reports how many row groups each query reads.
+
+    python benchmarks/bench_results_store.py --cities 5000
+"""
+
+import argparse
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from _common import timeit
+from bench_output_formats import make_results
+import results_store
+import tracker_snapshot
+
+def full_read(store_dir, name):
+    table = pq.read_table(os.path.join(store_dir, name + '.parquet'))
+    return tracker_snapshot.table_to_frame(table)
+
+def check(expected, result):
+    pd.testing.assert_frame_equal(expected.reset_index(drop=True), result.reset_index(drop=True), check_dtype=False,
+                                  check_categorical=False)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, default=5000)
+    parser.add_argument('--row-group-rows', type=int, default=16384)
+    args = parser.parse_args()
+
+    results = make_results(args.cities)
+    with tempfile.TemporaryDirectory() as store_dir:
+        seconds, _ = timeit(results_store.write_results_store, results, store_dir, args.row_group_rows)
+        print('{} cities: wrote {} peak rows and {} series rows in {:.2f}s'.format(
+            args.cities, len(results[3]), len(results[5]), seconds))
+        store = results_store.ResultsStore(store_dir)
+        city = results[5]['City'].iloc[len(results[5]) // 2]
+        source = results[5]['Data source'].iloc[len(results[5]) // 2]
+
+        def peaked_pandas():
+            df = full_read(store_dir, 'peaks')
+            df = df[(df['Use for dashboard?'] == 'yes') & (df['Peak Status'] == 'Peaked') &
+                    (df['Recent emissions year'] > 2015)]
+            return df[['City','Data source','Max emissions year','Recent emissions year']]
+
+        def series_pandas():
+            df = full_read(store_dir, 'series')
+            return df[(df['City'] == city) & (df['Data source'] == source)][['Data source','Year','Emissions']]
+
+        queries = [
+            ('peaked, latest after 2015', peaked_pandas, lambda: store.peaked_cities(latest_after=2015),
+             store.peaks.where('Use for dashboard?', '==', 'yes').where('Peak Status', '==', 'Peaked')
+             .where('Recent emissions year', '>', 2015)),
+            ('series of one city/source', series_pandas, lambda: store.city_series(city, source),
+             store.series.where('City', '==', city).where('Data source', '==', source)),
+            ]
+        print('{:<28} {:>10} {:>10} {:>10} {:>12}'.format('query', 'pandas s', 'store s', 'rows', 'row groups'))
+        for label, pandas_query, store_query, lazy in queries:
+            pandas_seconds, expected = timeit(pandas_query, repeat=3)
+            store_seconds, result = timeit(store_query, repeat=3)
+            check(expected, result)
+            print('{:<28} {:>10.4f} {:>10.4f} {:>10} {:>12}'.format(
+                label, pandas_seconds, store_seconds, len(result), '{}/{}'.format(
+                    len(lazy.row_groups()), len(store.index[lazy.name]['row_groups']))))
+
+if __name__ == '__main__':
+    main()
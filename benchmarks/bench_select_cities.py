@@ -0,0 +1,111 @@
+"""
+Benchmarks select_cities_to_use_in_dashboard against the original per-city loops and checks that both select the
+same data sources and set the same peak statuses.
+
+    python benchmarks/bench_select_cities.py --cities 10000 --registry-fraction 0.2
+"""
+
+import argparse
+import contextlib
+import io
+import os
+
+#The original breaks ties between Unknown data sources with the order sort_values(ascending=False) leaves tied rows
+#in, which is their original order with the quicksort of the pinned numpy. The AVX-512 quicksort of numpy 1.25+ does
+#not keep that order, so it is disabled for the reference. This must be set before numpy is imported.
+os.environ.setdefault('NPY_DISABLE_CPU_FEATURES', 'AVX512F')
+
+import numpy as np
+import pandas as pd
+
+from _common import DATA_SOURCES, make_wide_emissions, timeit
+import emissions_analysis as ea
+
+def loop_select_cities(df):
+    """
+    Original select_cities
+    """
+    #Create copy of dataframe and order by city and num data points 
+
+    df = df.sort_values(['City','Data quality']).reset_index(drop=True)
+    df1 = df.copy()
+        
+    for city, group in df1.groupby('City'):
+        
+        try: n_peaked = group['Peak Status'].value_counts()['Peaked']
+        except: n_peaked = 0
+            
+        try: n_not_peaked = group['Peak Status'].value_counts()['Not Peaked']
+        except: n_not_peaked = 0
+            
+        try: unknown = group['Peak Status'].value_counts()['Unknown']
+        except: unknown = 0
+            
+        if n_peaked > 0 and n_peaked >= n_not_peaked:
+            selected_index = group[group['Peak Status']=='Peaked'].index[0]
+
+        elif n_not_peaked > 0 and n_not_peaked > n_peaked:
+            selected_index = group[group['Peak Status']=='Not Peaked'].index[0]
+
+        else:
+            selected_index = group[group['Peak Status']=='Unknown'].sort_values('Num data points',ascending=False).index[0]
+            
+        df.loc[selected_index,'Use for dashboard?'] = 'yes'
+
+    df['Use for dashboard?'].fillna('no', inplace = True)
+    return df
+
+def loop_check_emissions_status(cities, df):
+    """
+    Original check_emissions_status_of_cities_that_have_peaked
+    """
+    for city, data_source in cities.items():
+        try:
+            current_status = df[(df['City']==city) & (df['Use for dashboard?']=='yes')]['Peak Status'].values[0]
+            current_index = df[(df['City']==city) & (df['Use for dashboard?']=='yes')]['Peak Status'].index[0]
+            if current_status != 'Peaked':
+                peak_index = df[(df['City']==city) & (df['Data source'] == data_source)].index[0]
+                if df.loc[peak_index, 'Percentage change since peak (%)']<=5.0:
+                    df.loc[peak_index, 'Peak Status'] = 'Peaked'
+                    if peak_index != current_index:
+                        df.loc[peak_index, 'Use for dashboard?'] = 'yes'
+                        df.loc[current_index, 'Use for dashboard?'] = 'no'
+                else:
+                    df.loc[peak_index, 'Peak Status'] = 'Peak Reversed'
+        except:
+            continue
+    return df
+
+def loop_select_cities_to_use_in_dashboard(df, cities):
+    return loop_check_emissions_status(cities, loop_select_cities(df))
+
+def make_previously_peaked_cities(df, fraction, seed=0):
+    """
+    Registers a fraction of cities as previously peaked with a random data source, some of which the city lacks
+    """
+    rng = np.random.default_rng(seed)
+    cities = df['City'].unique()
+    cities = cities[rng.random(len(cities)) < fraction]
+    sources = rng.choice(list(DATA_SOURCES) + ['All GPC considered'], size=len(cities))
+    return dict(zip(cities, sources))
+
+def run(n_cities, registry_fraction, current_year):
+    sources_per_city = len(DATA_SOURCES)
+    df = ea.calculate_peak_emissions(make_wide_emissions(n_cities * sources_per_city, sparsity=0.8), current_year)
+    df = df.sample(frac=0.8, random_state=0)
+    cities = make_previously_peaked_cities(df, registry_fraction)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        t_fast, fast = timeit(ea.select_cities_to_use_in_dashboard, df.copy(), cities)
+    t_slow, slow = timeit(loop_select_cities_to_use_in_dashboard, df.copy(), cities)
+    pd.testing.assert_frame_equal(fast, slow)
+    print('{} cities, {} rows, {} registered cities'.format(df['City'].nunique(), len(df), len(cities)))
+    print('vectorized {:.3f}s  loops {:.3f}s  speedup {:.0f}x'.format(t_fast, t_slow, t_slow / t_fast))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, default=10000)
+    parser.add_argument('--registry-fraction', type=float, default=0.2)
+    parser.add_argument('--current-year', type=int, default=2019)
+    args = parser.parse_args()
+    run(args.cities, args.registry_fraction, args.current_year)
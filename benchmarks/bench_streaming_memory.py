@@ -0,0 +1,105 @@
+"""
+Compares peak memory and run time of the in-memory pipeline with the streaming pipeline on a synthetic tracker, and
+checks that the streaming outputs match the in-memory results. Each run is done in a fresh process so its peak
+resident set size can be read from the operating system.
+
+    python benchmarks/bench_streaming_memory.py --cities 1000 10000 --partition 500
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from _common import make_long_tracker, make_registry
+import emissions_analysis as ea
+import streaming_pipeline
+import tracker_snapshot
+
+CURRENT_YEAR = 2019
+BASE_YEAR = 1990
+
+def peak_rss_mb():
+    #ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+def run_in_memory(source, target_path, registry):
+    df1 = tracker_snapshot.read_frame_snapshot(source)
+    df2 = ea.combine_gpc_and_non_gpc_data_sources(df1, BASE_YEAR, CURRENT_YEAR)
+    df3 = ea.calculate_peak_emissions(df2, CURRENT_YEAR)
+    df4 = ea.select_cities_to_use_in_dashboard(df3, registry=registry)
+    df5, df6 = ea.reshape_data_for_dashboard(df4)
+    results = (df1, df2, df3, df4, df5, df6)
+    for name, index in streaming_pipeline.STREAM_OUTPUTS.items():
+        writer = streaming_pipeline.PartitionWriter('{}_{}.parquet'.format(target_path, name))
+        writer.write(results[index])
+        writer.close()
+    return results
+
+def run_mode(mode, source, target_path, directory, partition):
+    registry = make_registry(directory, mode)
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            if mode == 'memory':
+                run_in_memory(source, target_path, registry)
+            else:
+                streaming_pipeline.run_streaming_pipeline(source, target_path, CURRENT_YEAR, BASE_YEAR,
+                                                          registry=registry, cities_per_partition=partition)
+        finally:
+            sys.stdout = stdout
+    print(json.dumps({'seconds':time.perf_counter() - start, 'peak_rss_mb':peak_rss_mb()}))
+
+def measure(mode, source, target_path, directory, partition):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, '--source', source,
+                             '--target', target_path, '--directory', directory, '--partition', str(partition)],
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def check_outputs_match(directory, memory_target, stream_target):
+    for name in streaming_pipeline.STREAM_OUTPUTS:
+        memory = streaming_pipeline.read_stream_output('{}_{}.parquet'.format(memory_target, name))
+        stream = streaming_pipeline.read_stream_output('{}_{}.parquet'.format(stream_target, name))
+        #Rows of the same City and Year are not in a fixed order after the melt, so compare in a fixed order
+        sort_by = ['City','Data source'] + (['Year'] if 'Year' in memory.columns else [])
+        pd.testing.assert_frame_equal(memory.sort_values(sort_by).reset_index(drop=True),
+                                      stream.sort_values(sort_by).reset_index(drop=True))
+    #Newly peaked cities are added to the registry once by both modes
+    assert make_registry(directory, 'memory').read() == make_registry(directory, 'stream').read()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--partition', type=int, default=500)
+    parser.add_argument('--child', choices=['memory','stream'])
+    parser.add_argument('--source')
+    parser.add_argument('--target')
+    parser.add_argument('--directory')
+    args = parser.parse_args()
+    if args.child:
+        run_mode(args.child, args.source, args.target, args.directory, args.partition)
+        return
+
+    print('{:>8} {:>10} {:>12} {:>10} {:>12}'.format('cities', 'memory s', 'memory MB', 'stream s', 'stream MB'))
+    for n_cities in args.cities:
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'tracker.arrow')
+            tracker_snapshot.write_frame_snapshot(make_long_tracker(n_cities), source)
+            results = {}
+            for mode in ['memory','stream']:
+                results[mode] = measure(mode, source, os.path.join(directory, mode), directory, args.partition)
+            check_outputs_match(directory, os.path.join(directory, 'memory'), os.path.join(directory, 'stream'))
+            print('{:>8} {:>10.2f} {:>12.0f} {:>10.2f} {:>12.0f}'.format(
+                n_cities, results['memory']['seconds'], results['memory']['peak_rss_mb'],
+                results['stream']['seconds'], results['stream']['peak_rss_mb']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+End-to-end benchmark suite. Times each stage of emissions_analysis.py and the dashboard callbacks on synthetic
+trackers of several sizes, writes the timings to JSON and flags timings that are slower than the stored baseline.
+
+    python benchmarks/run_suite.py                          # compare with benchmarks/baseline.json
+    python benchmarks/run_suite.py --save-baseline          # record a new baseline
+    python benchmarks/run_suite.py --sizes 100 1000 --threshold 1.5 --output results.json
+
+Baselines depend on the machine, so record one on the machine the suite is compared on. The exit code is 1 when a
+regression is flagged.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from _common import timeit
+import emissions_analysis as ea
+import synthetic_tracker
+
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend')
+if FRONTEND_DIR not in sys.path:
+    sys.path.insert(0, FRONTEND_DIR)
+from dashboard_data import DashboardData
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+CURRENT_YEAR = 2019
+BASE_YEAR = 1990
+FORMER_C40_CITIES = ['Basel','Caracas']
+
+def time_callbacks(df5, n_requests=200, seed=0):
+    """
+    Times the city selection callback: first requests with an empty cache and repeated requests served from it
+    """
+    data = DashboardData(df5, precompute=False)
+    cities = np.random.default_rng(seed).choice(data.cities, size=n_requests)
+    start = time.perf_counter()
+    for city in dict.fromkeys(cities):
+        data.city_view(city)
+    cold = (time.perf_counter() - start) / len(dict.fromkeys(cities))
+    start = time.perf_counter()
+    for city in cities:
+        data.city_view(city)
+    warm = (time.perf_counter() - start) / n_requests
+    return cold, warm
+
+def run_size(n_cities, repeat, directory, excel_limit):
+    """
+    Runs every benchmark for one tracker size
+    INPUT: Number of cities, repeats per benchmark (the best time is kept), scratch directory, largest size for
+    which the workbook is written and parsed
+    OUTPUT: Dictionary of benchmark name to seconds
+    """
+    timings = {}
+    raw = synthetic_tracker.make_tracker(n_cities)
+    def record(name, func, *args, copy=False):
+        if copy:
+            seconds, result = timeit(lambda: func(args[0].copy(), *args[1:]), repeat=repeat)
+        else:
+            seconds, result = timeit(func, *args, repeat=repeat)
+        timings[name] = seconds
+        return result
+
+    if n_cities <= excel_limit:
+        path = os.path.join(directory, 'tracker_{}.xlsx'.format(n_cities))
+        synthetic_tracker.write_tracker(raw, path)
+        record('read_excel', ea.read_in_data_from_master_emissions_tracker, path, FORMER_C40_CITIES)
+        cache_dir = os.path.join(directory, 'cache')
+        ea.read_in_data_from_master_emissions_tracker(path, FORMER_C40_CITIES, cache_dir)
+        record('read_cached', ea.read_in_data_from_master_emissions_tracker, path, FORMER_C40_CITIES, cache_dir)
+
+    df1 = record('clean_master_emissions_tracker', ea.clean_master_emissions_tracker, raw, FORMER_C40_CITIES,
+                 copy=True)
+    df2 = record('combine_gpc_and_non_gpc_data_sources', ea.combine_gpc_and_non_gpc_data_sources, df1, BASE_YEAR,
+                 CURRENT_YEAR)
+    df3 = record('calculate_peak_emissions', ea.calculate_peak_emissions, df2, CURRENT_YEAR, copy=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        df4 = record('select_cities_to_use_in_dashboard', ea.select_cities_to_use_in_dashboard, df3, {}, copy=True)
+    df5, df6 = record('reshape_data_for_dashboard', ea.reshape_data_for_dashboard, df4)
+    if n_cities <= excel_limit:
+        record('write_to_excel', ea.write_to_excel, (df1, df2, df3, df4, df5, df6),
+               os.path.join(directory, 'output_{}.xlsx'.format(n_cities)))
+
+    record('dashboard_load', DashboardData, df5)
+    cold, warm = time_callbacks(df5)
+    timings['callback_cold'] = cold
+    timings['callback_warm'] = warm
+    return timings
+
+def find_regressions(results, baseline, threshold, min_seconds):
+    """
+    Lists benchmarks slower than threshold times their baseline by more than min_seconds
+    INPUT: Results and baseline dictionaries of size to benchmark timings, slow down ratio, smallest slow down in
+    seconds that counts
+    OUTPUT: List of (size, benchmark, baseline seconds, seconds)
+    """
+    regressions = []
+    for size, timings in results.items():
+        for name, seconds in timings.items():
+            reference = baseline.get(size, {}).get(name)
+            if reference is not None and seconds > reference * threshold and seconds - reference > min_seconds:
+                regressions.append((size, name, reference, seconds))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000], help='Numbers of cities')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--excel-limit', type=int, default=1000,
+                        help='Largest size for which workbooks are read and written')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results to the baseline file')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Slow down ratio flagged as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.005,
+                        help='Slow downs smaller than this are ignored as noise')
+    parser.add_argument('--output', help='Path to write the results JSON to')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for n_cities in args.sizes:
+            results[str(n_cities)] = run_size(n_cities, args.repeat, directory, args.excel_limit)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    print('{:>6} {:<38} {:>10} {:>10} {:>8}'.format('cities', 'benchmark', 'baseline', 'seconds', 'ratio'))
+    for size, timings in results.items():
+        for name, seconds in timings.items():
+            reference = baseline.get(size, {}).get(name)
+            print('{:>6} {:<38} {:>10} {:>10.4f} {:>8}'.format(
+                size, name, '{:.4f}'.format(reference) if reference else '-', seconds,
+                '{:.2f}'.format(seconds / reference) if reference else '-'))
+
+    report = {'machine':{'platform':platform.platform(), 'processor':platform.processor(),
+                         'python':platform.python_version(), 'cpu_count':os.cpu_count()},
+              'results':results}
+    for path in filter(None, [args.output, args.baseline if args.save_baseline else None]):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+        print('Wrote {}'.format(path))
+
+    regressions = find_regressions(results, baseline, args.threshold, args.min_seconds)
+    for size, name, reference, seconds in regressions:
+        print('REGRESSION {} cities {}: {:.4f}s -> {:.4f}s ({:.2f}x)'.format(size, name, reference, seconds,
+                                                                           seconds / reference))
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
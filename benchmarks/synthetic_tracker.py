@@ -0,0 +1,88 @@
+"""
+Generates synthetic GHG master trackers in the schema of the 'All raw GHG_(excl.C40 GPC data)' sheet, so the
+pipeline can be run and benchmarked without the private tracker.
+
+    python benchmarks/synthetic_tracker.py --cities 1000 --sources 4 --first-year 1990 --last-year 2019 \
+        --sparsity 0.6 --output synthetic_tracker.xlsx
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from _common import DATA_SOURCES
+import emissions_analysis as ea
+
+#Sources the pipeline drops, generated so the cleaning step has rows to filter
+UNMAPPED_SOURCES = ['Other_Inventory','Modelled']
+
+def make_tracker(n_cities, sources_per_city=4, first_year=1990, last_year=2019, sparsity=0.6, seed=0,
+                 former_c40_cities=('Basel','Caracas')):
+    """
+    Builds a raw tracker sheet. Each city reports a random set of data sources, and each source reports a random
+    subset of years of a trend that peaks in a random year, possibly after the last year. A few rows have missing
+    emissions, are marked as not used in peaking or come from sources the pipeline does not map.
+    INPUT: Number of cities, data sources per city, first and last inventory year, fraction of years without an
+    inventory, random seed, former C40 cities to include
+    OUTPUT: DataFrame with the tracker sheet columns
+    """
+    rng = np.random.default_rng(seed)
+    sources = np.array(list(DATA_SOURCES) + UNMAPPED_SOURCES)
+    cities = np.array(['Synthetic City {:06d}'.format(i) for i in range(n_cities)] + list(former_c40_cities))
+    sources_per_city = min(sources_per_city, len(sources))
+    years = np.arange(first_year, last_year + 1)
+
+    #Sources of each city, drawn without replacement from the mapped sources with the occasional unmapped one
+    weights = np.r_[np.ones(len(DATA_SOURCES)), np.full(len(UNMAPPED_SOURCES), 0.1)]
+    picks = np.argsort(rng.random((len(cities), len(sources))) ** (1 / weights), axis=1)[:, -sources_per_city:]
+    series_city = np.repeat(cities, sources_per_city)
+    series_source = sources[picks.ravel()]
+
+    #Emissions rise to a random peak year and then fall, with noise. Peaks after the last year are not yet reached.
+    n_series = len(series_city)
+    peak = rng.integers(0, len(years) + len(years) // 2, size=n_series)[:, None]
+    trend = np.where(np.arange(len(years)) <= peak, 0.02, 0.03) * np.abs(np.arange(len(years)) - peak)
+    level = rng.uniform(1e5, 5e7, size=(n_series, 1))
+    emissions = level * np.exp(-trend + rng.normal(0, 0.02, size=(n_series, len(years))))
+    reported = rng.random((n_series, len(years))) >= sparsity
+
+    series, year = np.nonzero(reported)
+    n_rows = len(series)
+    emission_values = emissions[series, year]
+    emission_values[rng.random(n_rows) < 0.01] = np.nan
+    use = rng.choice(['Yes','yes','Y','y','No'], size=n_rows, p=[0.7, 0.1, 0.05, 0.05, 0.1])
+
+    df = pd.DataFrame({
+        'Region':'Synthetic',
+        'City name tidy up':series_city[series],
+        'Source_Protocol':series_source[series],
+        'Inventory\n_year.1':years[year].astype(float),
+        'Emissions\n_mtCO2e':emission_values,
+        'Use in peaking (Yes or No)':use,
+        })
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+def write_tracker(df, path):
+    """
+    Writes a tracker to a workbook laid out like the master tracker: a title row, then the header on the second row
+    INPUT: Tracker DataFrame, target path (.xlsx)
+    OUTPUT: None
+    """
+    with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+        df.to_excel(writer, sheet_name=ea.TRACKER_SHEET, index=False, startrow=1)
+        writer.sheets[ea.TRACKER_SHEET].write(0, 0, 'Synthetic GHG master tracker')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, default=1000)
+    parser.add_argument('--sources', type=int, default=4, help='Data sources per city')
+    parser.add_argument('--first-year', type=int, default=1990)
+    parser.add_argument('--last-year', type=int, default=2019)
+    parser.add_argument('--sparsity', type=float, default=0.6, help='Fraction of years without an inventory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='synthetic_tracker.xlsx')
+    args = parser.parse_args()
+    df = make_tracker(args.cities, args.sources, args.first_year, args.last_year, args.sparsity, args.seed)
+    write_tracker(df, args.output)
+    print('Wrote {} rows for {} cities to {}'.format(len(df), args.cities, args.output))
@@ -0,0 +1,77 @@
+"""
+Precomputed, per-city view of the dashboard data used by the Dash callbacks. Everything a callback needs is
+indexed by city when the data is loaded so callback latency does not grow with the size of the dataset.
+"""
+
+import functools
+
+import numpy as np
+import pandas as pd
+
+BAR_COLOUR = '#5DADE2'
+
+class DashboardData(object):
+    """
+    Per-city index over the DASHBOARD_Peak_Emissions frame. City views (status, data source and bar chart figure)
+    are served from an LRU cache, which is filled at load time when precompute is True.
+    """
+    def __init__(self, df, cache_size=1024, precompute=True):
+        self.df = df
+        self.max_emissions = df['Emissions'].max()
+        self.peak_count = int(df.loc[df['Peak year'] == 1, 'Peak year'].sum())
+        self.cities = list(df['City'].unique())
+        self.options = [{'label':city, 'value':city} for city in self.cities]
+        self._rows = df.groupby('City', sort=False).indices
+        self.city_view = functools.lru_cache(maxsize=cache_size)(self._city_view)
+
+        #Peak emissions table
+        df2 = df[df['Peak year']==1]
+        df2 = df2[['City','Year','Emissions']]
+        df2['Emissions'] = df2['Emissions'].round()
+        df2 = df2.rename(columns={'Year':'Peak year','Emissions':'Peak Emissions'})
+        self.peak_table = df2.sort_values('Peak year')
+
+        if precompute:
+            for city in self.cities[:cache_size]:
+                self.city_view(city)
+
+    def __contains__(self, city_name):
+        return city_name in self._rows
+
+    def default_city(self, preferred='Accra'):
+        return preferred if preferred in self else self.cities[0]
+
+    def _city_view(self, city_name):
+        rows = self.df.iloc[self._rows[city_name]]
+        source_column = 'Protocol' if 'Protocol' in rows.columns else 'Data source'
+        figure = {'data':[{'type':'bar',
+                           'x':rows['Year'].tolist(),
+                           'y':rows['Emissions'].tolist(),
+                           'name':'test',
+                           'marker':{'color':BAR_COLOUR}}],
+                  'layout':{'xaxis':{'title':'Year'},
+                            'yaxis':{'title':'Emissions / tCO2e', 'range':[0, self.max_emissions]},
+                            'margin':{'t':0}}}
+        return {'status':' ' + rows['Peak Status'].iloc[0],
+                'data_source':rows[source_column].iloc[0],
+                'figure':figure}
+
+def make_synthetic_dashboard_frame(n_cities, first_year=1990, last_year=2018, seed=0):
+    """
+    Builds a frame in the DASHBOARD_Peak_Emissions layout for load testing
+    INPUT: Number of cities, year range, random seed
+    OUTPUT: DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    years = np.arange(first_year, last_year + 1)
+    cities = ['City {:05d}'.format(i) for i in range(n_cities)]
+    statuses = rng.choice(['Peaked','Not Peaked','Unknown'], size=n_cities)
+    df = pd.DataFrame({'City':np.repeat(cities, len(years)),
+                       'Year':np.tile(years, n_cities),
+                       'Emissions':rng.uniform(1e5, 5e7, size=n_cities * len(years)),
+                       'Peak Status':np.repeat(statuses, len(years)),
+                       'Protocol':np.repeat(rng.choice(['C40_GPC','City_GPC','CDP_Other'], size=n_cities), len(years))})
+    peak_year = rng.choice(years, size=n_cities)
+    df['Peak year'] = ((df['Year'] == np.repeat(peak_year, len(years))) &
+                       (df['Peak Status'] == 'Peaked')).astype(int)
+    return df
@@ -0,0 +1,87 @@
+"""
+Background data service for the Dash app. Watches the dashboard snapshot written by the ETL pipeline, loads new
+versions off the request thread and swaps them in as a whole, so callbacks always read one complete DashboardData.
+"""
+
+import os
+import threading
+import traceback
+
+from tracker_snapshot import read_excel_snapshot, read_frame_snapshot
+from dashboard_data import DashboardData
+
+def load_dashboard_frame(path):
+    """
+    Reads the dashboard data from an Arrow snapshot, or from the DASHBOARD_Peak_Emissions sheet of a workbook
+    INPUT: Snapshot (.arrow) or workbook (.xlsx) path
+    OUTPUT: DataFrame
+    """
+    if path.endswith('.xlsx'):
+        return read_excel_snapshot(path, sheet_name='DASHBOARD_Peak_Emissions')
+    return read_frame_snapshot(path)
+
+class DashboardDataService(object):
+    """
+    Holds the current DashboardData and replaces it when the source file changes. The snapshot is only ever
+    replaced by assigning a fully built DashboardData, so a request that reads `current` once sees a consistent
+    view even if a reload finishes while it is running.
+    """
+    def __init__(self, path, poll_interval=30, loader=load_dashboard_frame):
+        self.path = os.path.expanduser(path)
+        self.poll_interval = poll_interval
+        self.loader = loader
+        self.current = None
+        self._signature = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def refresh(self):
+        """
+        Loads the source file if it changed since the last load and swaps in the new DashboardData
+        INPUT: None
+        OUTPUT: True if a new snapshot was loaded
+        """
+        with self._lock:
+            signature = self._file_signature()
+            if signature == self._signature:
+                return False
+            data = DashboardData(self.loader(self.path))
+            self.current = data
+            self._signature = signature
+            return True
+
+    def _watch(self):
+        while True:
+            try:
+                if self.refresh():
+                    print('Loaded dashboard data from {}'.format(self.path))
+            except Exception:
+                #Keep serving the current snapshot, e.g. while the ETL is replacing the file
+                traceback.print_exc()
+            if self._stop.wait(self.poll_interval):
+                break
+
+    def start(self):
+        """
+        Loads the first snapshot and then watches the source file in a daemon thread. The first load blocks, and
+        raises if the file cannot be read, so `current` is never None once the app serves requests.
+        INPUT: None
+        OUTPUT: self
+        """
+        if self.current is None:
+            self.refresh()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name='dashboard-data-service', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,85 @@
+"""
+Load test for the dashboard callbacks. Measures p50/p99 latency either in process, by calling the data layer that
+backs the callbacks, or over HTTP against a running Dash server.
+
+    python frontend/load_test.py --cities 100 1000 10000
+    python frontend/load_test.py --url http://127.0.0.1:8050 --user USER --password PASSWORD --requests 500
+"""
+
+import argparse
+import base64
+import json
+import time
+import urllib.request
+
+import numpy as np
+
+from dashboard_data import DashboardData, make_synthetic_dashboard_frame
+
+#Outputs of the update_city callback, all returned by one request per city selection
+CALLBACK_OUTPUTS = [('peaking_status','children'), ('data_source','children'), ('graph_title','children'),
+                    ('my_graph','figure')]
+
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+def run_in_process(n_cities, n_requests, seed=0):
+    """
+    Times callback lookups for random city selections, after the data has been loaded
+    """
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    data = DashboardData(make_synthetic_dashboard_frame(n_cities))
+    load_seconds = time.perf_counter() - start
+
+    latencies = []
+    for city in rng.choice(data.cities, size=n_requests):
+        start = time.perf_counter()
+        data.city_view(city)
+        latencies.append(time.perf_counter() - start)
+    p50, p99 = percentiles(latencies)
+    print('{:>8} cities  load {:>7.2f}s  p50 {:>7.3f}ms  p99 {:>7.3f}ms'.format(n_cities, load_seconds, p50, p99))
+
+def post_callback(url, outputs, city, headers):
+    body = {'output':'..' + '...'.join('{}.{}'.format(*output) for output in outputs) + '..',
+            'outputs':[{'id':output[0], 'property':output[1]} for output in outputs],
+            'inputs':[{'id':'city_picker', 'property':'value', 'value':city}],
+            'changedPropIds':['city_picker.value']}
+    request = urllib.request.Request(url.rstrip('/') + '/_dash-update-component', data=json.dumps(body).encode(),
+                                     headers=headers)
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+def run_http(url, cities, n_requests, user=None, password=None, seed=0):
+    """
+    Times the HTTP round trips made for each city selection against a running server
+    """
+    rng = np.random.default_rng(seed)
+    headers = {'Content-Type':'application/json'}
+    if user:
+        token = base64.b64encode('{}:{}'.format(user, password).encode()).decode()
+        headers['Authorization'] = 'Basic ' + token
+
+    latencies = []
+    for city in rng.choice(cities, size=n_requests):
+        start = time.perf_counter()
+        post_callback(url, CALLBACK_OUTPUTS, city, headers)
+        latencies.append(time.perf_counter() - start)
+    p50, p99 = percentiles(latencies)
+    print('{} selections  p50 {:.1f}ms  p99 {:.1f}ms'.format(n_requests, p50, p99))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--url', help='Base URL of a running dashboard to test over HTTP')
+    parser.add_argument('--city', action='append', default=None, help='City to select in HTTP mode (repeatable)')
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    args = parser.parse_args()
+    if args.url:
+        run_http(args.url, args.city or ['Accra'], args.requests, args.user, args.password)
+    else:
+        for n in args.cities:
+            run_in_process(n, args.requests)
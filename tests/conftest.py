@@ -0,0 +1,12 @@
+"""
+Puts the backend modules and the synthetic data helpers shared with the benchmarks (benchmarks/_common.py) on the
+import path of the tests.
+"""
+
+import os
+import sys
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for directory in [os.path.join(ROOT_DIR, 'app', 'backend'), os.path.join(ROOT_DIR, 'benchmarks')]:
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
@@ -0,0 +1,57 @@
+"""
+Checks that run_incremental_pipeline returns the same DataFrames as a full run_etl_pipeline run on the same tracker
+when a few cities change, when nothing changes and when the set of years changes, which needs a full run.
+"""
+
+import pandas as pd
+
+from _common import make_registry
+from synthetic_tracker import make_tracker, write_tracker
+import emissions_analysis as ea
+import incremental_run
+
+CURRENT_YEAR = 2019
+BASE_YEAR = 1990
+FORMER_C40_CITIES = ['Basel','Caracas']
+
+def check_matches_full_run(tmp_path, name, tracker, state_dir, registry):
+    """
+    Runs the incremental pipeline and a full run on the tracker, the full run with a copy of the registry as it was
+    before the incremental run, and checks that all 6 DataFrames and the registries match
+    """
+    path = tmp_path / (name + '.xlsx')
+    write_tracker(tracker, str(path))
+    full_registry = make_registry(tmp_path, name, registry.read())
+    results, report = incremental_run.run_incremental_pipeline(str(path), CURRENT_YEAR, BASE_YEAR,
+                                                               FORMER_C40_CITIES, str(state_dir), registry=registry)
+    expected = ea.run_etl_pipeline(str(path), CURRENT_YEAR, BASE_YEAR, FORMER_C40_CITIES, registry=full_registry)
+    for df, expected_df in zip(results, expected):
+        pd.testing.assert_frame_equal(df.reset_index(drop=True), expected_df.reset_index(drop=True))
+    assert registry.read() == full_registry.read()
+    return report
+
+def test_incremental_run_matches_full_run(tmp_path):
+    state_dir = tmp_path / 'state'
+    registry = make_registry(tmp_path, 'incremental')
+    tracker = make_tracker(30, seed=1)
+    report = check_matches_full_run(tmp_path, 'first', tracker, state_dir, registry)
+    assert report['full_run'] and report['cities_recomputed'] == report['cities_total']
+
+    #Later inventories of two cities fall and one data source of a third city is withdrawn
+    cities = sorted(set(tracker['City name tidy up']) - set(FORMER_C40_CITIES))
+    changed = tracker.copy()
+    falling = changed['City name tidy up'].isin(cities[:2]) & (changed['Inventory\n_year.1'] >= 2010)
+    changed.loc[falling, 'Emissions\n_mtCO2e'] *= 0.5
+    source = changed.loc[changed['City name tidy up'] == cities[2], 'Source_Protocol'].iloc[0]
+    changed = changed[~((changed['City name tidy up'] == cities[2]) & (changed['Source_Protocol'] == source))]
+    report = check_matches_full_run(tmp_path, 'changed', changed, state_dir, registry)
+    assert not report['full_run'] and report['cities_recomputed'] == 3
+
+    report = check_matches_full_run(tmp_path, 'unchanged', changed, state_dir, registry)
+    assert not report['full_run'] and report['cities_recomputed'] == 0
+
+    #An inventory before the base year adds a year column to every city
+    earlier = changed.iloc[:1].assign(**{'Inventory\n_year.1':1985.0, 'Use in peaking (Yes or No)':'Yes',
+                                         'Emissions\n_mtCO2e':1e6, 'Source_Protocol':'City_Other'})
+    report = check_matches_full_run(tmp_path, 'years', pd.concat([changed, earlier]), state_dir, registry)
+    assert report['full_run'] and report['cities_recomputed'] == report['cities_total']
@@ -0,0 +1,85 @@
+"""
+Checks the data source select_cities_to_use_in_dashboard picks for each city on small hand-made cases: ties between
+Unknown data sources, ties between Peaked and Not Peaked data sources, and cities in the peaked city registry.
+"""
+
+import contextlib
+import io
+
+import pandas as pd
+
+from _common import DATA_SOURCES, make_registry
+import emissions_analysis as ea
+
+def make_frame(rows):
+    """
+    Builds a calculate_peak_emissions style DataFrame from (City, Data source, Peak Status, Num data points,
+    Percentage change since peak) tuples
+    """
+    df = pd.DataFrame(rows, columns=['City','Data source','Peak Status','Num data points',
+                                     'Percentage change since peak (%)'])
+    df.insert(2, 'Data quality', df['Data source'].map(DATA_SOURCES))
+    return df
+
+def selected(df):
+    rows = df[df['Use for dashboard?'] == 'yes']
+    assert rows['City'].is_unique
+    return dict(zip(rows['City'], rows['Data source']))
+
+def select(df, cities=None, registry=None):
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        result = ea.select_cities_to_use_in_dashboard(df, cities, registry)
+    return result, out.getvalue()
+
+def test_unknown_ties_take_best_data_quality():
+    #Rows are out of data quality order so the sort by data quality is exercised too
+    df = make_frame([
+        ('Accra','CDP_GPC','Unknown',5,0.0),
+        ('Accra','C40_GPC','Unknown',5,0.0),
+        ('Accra','City_GPC','Unknown',5,0.0),
+        ('Bogota','City_Other','Unknown',6,0.0),
+        ('Bogota','C40_GPC','Unknown',4,0.0),
+        ('Bogota','CDP_GPC','Unknown',6,0.0),
+        ('Bogota','City_GPC','Unknown',2,0.0),
+        ])
+    result, _ = select(df, cities={})
+    assert selected(result) == {'Accra':'C40_GPC', 'Bogota':'CDP_GPC'}
+
+def test_peaked_and_not_peaked_ties():
+    df = make_frame([
+        #One Peaked and one Not Peaked: Peaked wins and its best data source is used
+        ('Accra','C40_GPC','Not Peaked',8,0.0),
+        ('Accra','City_Other','Peaked',8,0.0),
+        ('Accra','CDP_GPC','Peaked',9,0.0),
+        #More Not Peaked than Peaked: the best Not Peaked data source is used, whatever its data points
+        ('Bogota','CDP_Other','Not Peaked',9,0.0),
+        ('Bogota','Target_Other','Peaked',9,0.0),
+        ('Bogota','City_GPC','Not Peaked',3,0.0),
+        ('Bogota','C40_GPC','Unknown',12,0.0),
+        ])
+    result, _ = select(df, cities={})
+    assert selected(result) == {'Accra':'CDP_GPC', 'Bogota':'City_GPC'}
+
+def test_registry_reconciliation(tmp_path):
+    registry = make_registry(tmp_path, 'registry', {'Cairo':'City_Other', 'Dakar':'CDP_GPC', 'Lima':'C40_GPC'})
+    df = make_frame([
+        #Registered data source still within 5% of its peak: set back to Peaked and used
+        ('Cairo','C40_GPC','Not Peaked',10,0.0),
+        ('Cairo','City_Other','Unknown',4,3.0),
+        #Registered data source more than 5% above its peak: Peak Reversed, selection unchanged
+        ('Dakar','C40_GPC','Not Peaked',10,0.0),
+        ('Dakar','CDP_GPC','Not Peaked',10,12.0),
+        #Registered and still Peaked: unchanged
+        ('Lima','C40_GPC','Peaked',7,0.0),
+        #Newly peaked: reported and added to the registry
+        ('Quito','City_GPC','Peaked',5,0.0),
+        ])
+    result, out = select(df, registry=registry)
+
+    assert selected(result) == {'Cairo':'City_Other', 'Dakar':'C40_GPC', 'Lima':'C40_GPC', 'Quito':'City_GPC'}
+    status = result.set_index(['City','Data source'])['Peak Status']
+    assert status[('Cairo','City_Other')] == 'Peaked'
+    assert status[('Dakar','CDP_GPC')] == 'Peak Reversed'
+    assert status[('Dakar','C40_GPC')] == 'Not Peaked'
+    assert out.splitlines() == ['New cities have peaked!', 'Quito']
+    assert registry.read() == {'Cairo':'City_Other', 'Dakar':'CDP_GPC', 'Lima':'C40_GPC', 'Quito':'City_GPC'}
@@ -0,0 +1,41 @@
+"""
+Checks that the streaming pipeline reports newly peaked cities and adds them to the registry once for the whole run,
+as the in-memory pipeline does, rather than once per city partition.
+"""
+
+import contextlib
+import io
+
+from _common import make_long_tracker, make_registry
+import emissions_analysis as ea
+import streaming_pipeline
+import tracker_snapshot
+
+CURRENT_YEAR = 2019
+BASE_YEAR = 1990
+
+def test_new_peaked_cities_reported_once(tmp_path):
+    df1 = make_long_tracker(40)
+    #One city is already registered, so it is not reported as newly peaked
+    registered = {df1['City'].iloc[0]:'C40_GPC'}
+    source = str(tmp_path / 'tracker.arrow')
+    tracker_snapshot.write_frame_snapshot(df1, source)
+
+    memory_registry = make_registry(tmp_path, 'memory', registered)
+    with contextlib.redirect_stdout(io.StringIO()) as memory_out:
+        df2 = ea.combine_gpc_and_non_gpc_data_sources(df1, BASE_YEAR, CURRENT_YEAR)
+        df3 = ea.calculate_peak_emissions(df2, CURRENT_YEAR)
+        ea.select_cities_to_use_in_dashboard(df3, registry=memory_registry)
+
+    stream_registry = make_registry(tmp_path, 'stream', registered)
+    with contextlib.redirect_stdout(io.StringIO()) as stream_out:
+        summary = streaming_pipeline.run_streaming_pipeline(source, str(tmp_path / 'stream'), CURRENT_YEAR,
+                                                            BASE_YEAR, registry=stream_registry,
+                                                            cities_per_partition=5)
+
+    assert summary['partitions'] == 8
+    lines = stream_out.getvalue().splitlines()
+    assert lines.count('New cities have peaked!') == 1 and 'No new cities have peaked' not in lines
+    assert lines == memory_out.getvalue().splitlines()
+    assert stream_registry.read() == memory_registry.read()
+    assert len(stream_registry.read()) > 1
@@ -0,0 +1,52 @@
+"""
+Checks that every grid point of run_threshold_sweep selects, for each city, the data source and status that the
+select_cities rules give for calculate_peak_emissions run with the grid point's thresholds, including cities whose
+Unknown data sources have the same number of data points.
+"""
+
+import pandas as pd
+
+from _common import DATA_SOURCES, make_wide_emissions
+import emissions_analysis as ea
+import peaking_sweep
+
+CURRENT_YEAR = 2019
+
+def reference_selection(df3):
+    """
+    The select_cities rules written out city by city: Peaked if at least as many Peaked as Not Peaked data sources,
+    Not Peaked if more Not Peaked, otherwise Unknown. The best data quality with the city status is used, or for
+    Unknown cities the most data points and then the best data quality.
+    """
+    rows = []
+    for city, group in df3.sort_values(['City','Data quality']).groupby('City', sort=True):
+        statuses = list(group['Peak Status'])
+        n_peaked, n_not_peaked = statuses.count('Peaked'), statuses.count('Not Peaked')
+        if n_peaked > 0 and n_peaked >= n_not_peaked:
+            row = group[group['Peak Status'] == 'Peaked'].iloc[0]
+        elif n_not_peaked > n_peaked:
+            row = group[group['Peak Status'] == 'Not Peaked'].iloc[0]
+        else:
+            unknown = group[group['Peak Status'] == 'Unknown']
+            row = unknown.loc[unknown['Num data points'] == unknown['Num data points'].max()].iloc[0]
+        rows.append((city, row['Data source'], row['Peak Status']))
+    return pd.DataFrame(rows, columns=['City','Data source','Peak Status'])
+
+def test_sweep_matches_single_runs():
+    #Inventories are sparse so many cities have Unknown data sources with the same number of data points
+    df = make_wide_emissions(300 * len(DATA_SOURCES), current_year=CURRENT_YEAR, sparsity=(0.6, 0.98))
+    grid = {'min_reduction_from_peak':[0.05, 0.1], 'max_inventory_age':[3, 5]}
+    grid_df, results = peaking_sweep.run_threshold_sweep(df, CURRENT_YEAR, grid, processes=1)
+
+    tied_unknown = 0
+    for point, thresholds in enumerate(peaking_sweep.build_threshold_grid(grid)):
+        df3 = ea.calculate_peak_emissions(df.copy(), CURRENT_YEAR, thresholds=thresholds)
+        expected = reference_selection(df3)
+        sweep = results[results['Grid point'] == point][['City','Data source','Peak Status']]
+        pd.testing.assert_frame_equal(expected, sweep.astype(str).reset_index(drop=True))
+
+        unknown = df3[df3.groupby('City')['Peak Status'].transform(lambda x: (x == 'Unknown').all())]
+        most = unknown.groupby('City')['Num data points'].transform('max')
+        tied_unknown += (unknown[unknown['Num data points'] == most].groupby('City').size() > 1).sum()
+    #The grid must include Unknown cities with tied data sources for the tie break to be checked
+    assert tied_unknown > 0